@@ -7,6 +7,9 @@ from dotenv import load_dotenv
 load_dotenv()
 
 class Settings:
+    # Debug endpoints (never enable in production)
+    DEBUG: bool = os.getenv("DEBUG", "false").lower() in ("1", "true", "yes")
+    
     # Database
     SUPABASE_URL: str = os.getenv("SUPABASE_URL", "")
     SUPABASE_KEY: str = os.getenv("SUPABASE_KEY", "")
@@ -35,6 +38,20 @@ class Settings:
     MAX_RETRIES: int = int(os.getenv("MAX_RETRIES", "3"))
     CHUNK_TIMEOUT: int = int(os.getenv("CHUNK_TIMEOUT", "30"))
     CONCURRENT_UPLOADS: int = int(os.getenv("CONCURRENT_UPLOADS", "3"))
+    MAX_BATCH_CHUNKS: int = int(os.getenv("MAX_BATCH_CHUNKS", "16"))  # Per /upload/chunks/batch request
+    
+    # Pooled buffers for copying uploads to disk; also caps concurrent copies
+    COPY_BUFFER_COUNT: int = int(os.getenv("COPY_BUFFER_COUNT", "32"))
+    # Each read is one hasher.update(); at least 16KB keeps OpenSSL on its SHA-NI/ARMv8 block path
+    COPY_BUFFER_SIZE: int = max(16384, int(os.getenv("COPY_BUFFER_SIZE", "65536")))  # 64KB
+    
+    # Chat file downloads are re-hashed only when the last check is older than this
+    FILE_REVERIFY_HOURS: int = int(os.getenv("FILE_REVERIFY_HOURS", "24"))
+    
+    # When set (e.g. "/_protected_files/"), chat downloads are handed to Nginx with
+    # X-Accel-Redirect instead of streamed by Python. The matching location must be
+    # `internal;` with `alias` pointing at UPLOAD_DIR. Empty disables the offload.
+    X_ACCEL_REDIRECT_PREFIX: str = os.getenv("X_ACCEL_REDIRECT_PREFIX", "")
     
     # Database connection settings
     DB_TIMEOUT: int = int(os.getenv("DB_TIMEOUT", "10"))  # 10 seconds
@@ -44,6 +61,7 @@ class Settings:
     # Paths
     TEMP_DIR: Path = Path("temp_chunks")
     UPLOAD_DIR: Path = Path("uploaded_files")
+    CHAT_FILES_DIR: Path = UPLOAD_DIR / "chat"
     
     def __init__(self):
         # Validate required settings
@@ -53,5 +71,6 @@ class Settings:
         # Create directories
         self.TEMP_DIR.mkdir(exist_ok=True)
         self.UPLOAD_DIR.mkdir(exist_ok=True)
+        self.CHAT_FILES_DIR.mkdir(parents=True, exist_ok=True)
 
 settings = Settings()
\ No newline at end of file
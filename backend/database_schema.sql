@@ -72,6 +72,12 @@ CREATE TABLE IF NOT EXISTS uploaded_chunks (
 
 -- Create indexes for better performance
 CREATE INDEX IF NOT EXISTS idx_users_email ON users(email);
+
+-- Existing deployments: the API lowercases emails before every lookup, so lowercase
+-- stored ones and keep them unique regardless of case (the UPDATE fails, rather than
+-- merging accounts, if two rows differ only by case; resolve those by hand first)
+UPDATE users SET email = lower(email) WHERE email <> lower(email);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_users_email_lower ON users(lower(email));
 CREATE INDEX IF NOT EXISTS idx_users_username ON users(username);
 CREATE INDEX IF NOT EXISTS idx_user_sessions_user_id ON user_sessions(user_id);
 CREATE INDEX IF NOT EXISTS idx_user_sessions_refresh_token ON user_sessions(refresh_token);
@@ -140,12 +146,18 @@ CREATE TABLE IF NOT EXISTS messages (
     file_name VARCHAR(255),
     file_size BIGINT,
     file_hash VARCHAR(128), -- ✅ USES EXISTING HASH VERIFICATION
+    verified_at TIMESTAMP WITH TIME ZONE, -- Last successful integrity check of file_path
+    tree_hash VARCHAR(128), -- Parallel-verifiable SHA-256 tree hash, set for large files
     
     reply_to_id UUID REFERENCES messages(id), -- For message replies
     created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
     updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
 );
 
+-- Existing deployments: add the integrity check timestamp
+ALTER TABLE messages ADD COLUMN IF NOT EXISTS verified_at TIMESTAMP WITH TIME ZONE;
+ALTER TABLE messages ADD COLUMN IF NOT EXISTS tree_hash VARCHAR(128);
+
 -- Message Status (read receipts, delivery status)
 CREATE TABLE IF NOT EXISTS message_status (
     id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
@@ -172,6 +184,11 @@ CREATE INDEX IF NOT EXISTS idx_chat_rooms_created_by ON chat_rooms(created_by);
 CREATE INDEX IF NOT EXISTS idx_chat_rooms_type ON chat_rooms(type);
 CREATE INDEX IF NOT EXISTS idx_file_sessions_chat_room_id ON file_sessions(chat_room_id);
 
+-- Full-text search over message content (stemmed); an expression index keeps
+-- the tsvector out of every SELECT * on messages
+CREATE INDEX IF NOT EXISTS idx_messages_content_fts
+    ON messages USING GIN (to_tsvector('english', COALESCE(content, '')));
+
 -- Create triggers for chat tables
 CREATE TRIGGER update_chat_rooms_updated_at 
     BEFORE UPDATE ON chat_rooms 
@@ -183,6 +200,89 @@ CREATE TRIGGER update_messages_updated_at
     FOR EACH ROW 
     EXECUTE FUNCTION update_updated_at_column();
 
+-- Create a room with its creator (admin) and members in one transaction and
+-- return the room plus member details, saving the API several round-trips
+CREATE OR REPLACE FUNCTION create_chat_room_with_members(
+    p_creator_id UUID,
+    p_room_type TEXT,
+    p_room_name TEXT,
+    p_member_ids UUID[]
+)
+RETURNS JSONB AS $$
+DECLARE
+    new_room chat_rooms%ROWTYPE;
+BEGIN
+    INSERT INTO chat_rooms (type, created_by, name)
+    VALUES (p_room_type, p_creator_id, p_room_name)
+    RETURNING * INTO new_room;
+
+    INSERT INTO chat_room_members (room_id, user_id, role)
+    SELECT DISTINCT new_room.id, member_id,
+           CASE WHEN member_id = p_creator_id THEN 'admin' ELSE 'member' END
+    FROM UNNEST(ARRAY[p_creator_id] || p_member_ids) AS member_id;
+
+    RETURN jsonb_build_object(
+        'room', to_jsonb(new_room),
+        'members', COALESCE((
+            SELECT jsonb_agg(jsonb_build_object(
+                'user_id', m.user_id,
+                'username', u.username,
+                'email', u.email,
+                'role', m.role,
+                'joined_at', m.joined_at
+            ))
+            FROM chat_room_members m
+            JOIN users u ON u.id = m.user_id
+            WHERE m.room_id = new_room.id
+        ), '[]'::jsonb)
+    );
+END;
+$$ language 'plpgsql';
+
+-- Search a room's messages through idx_messages_content_fts; p_query is a
+-- to_tsquery expression built by the API (e.g. 'upload:* & fail:*'). Words match
+-- by English stem and prefix, not as substrings. When the query reduces to nothing
+-- (only stopwords such as "the" or "is", or no words at all) the raw search text
+-- p_text is matched as a substring instead, as before full-text search.
+DROP FUNCTION IF EXISTS search_room_messages(UUID, TEXT, INTEGER);
+CREATE OR REPLACE FUNCTION search_room_messages(
+    p_room_id UUID,
+    p_query TEXT,
+    p_limit INTEGER,
+    p_text TEXT
+)
+RETURNS JSONB AS $$
+BEGIN
+    IF numnode(to_tsquery('english', p_query)) > 0 THEN
+        RETURN (
+            SELECT COALESCE(jsonb_agg(found ORDER BY found.created_at DESC), '[]'::jsonb)
+            FROM (
+                SELECT m.*, COALESCE(u.username, 'Unknown') AS sender_username
+                FROM messages m
+                LEFT JOIN users u ON u.id = m.sender_id
+                WHERE m.room_id = p_room_id
+                  AND to_tsvector('english', COALESCE(m.content, '')) @@ to_tsquery('english', p_query)
+                ORDER BY m.created_at DESC
+                LIMIT p_limit
+            ) AS found
+        );
+    END IF;
+    
+    RETURN (
+        SELECT COALESCE(jsonb_agg(found ORDER BY found.created_at DESC), '[]'::jsonb)
+        FROM (
+            SELECT m.*, COALESCE(u.username, 'Unknown') AS sender_username
+            FROM messages m
+            LEFT JOIN users u ON u.id = m.sender_id
+            WHERE m.room_id = p_room_id
+              AND m.content ILIKE '%' || p_text || '%'
+            ORDER BY m.created_at DESC
+            LIMIT p_limit
+        ) AS found
+    );
+END;
+$$ LANGUAGE plpgsql STABLE;
+
 -- Disable RLS for development (since we're using custom auth, not Supabase Auth)
 -- In production, you might want to enable RLS with proper service role policies
 ALTER TABLE users DISABLE ROW LEVEL SECURITY;
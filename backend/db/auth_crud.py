@@ -1,8 +1,9 @@
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 from datetime import datetime, timedelta
 from supabase import create_client
 from config import settings
 from services.auth_service import auth_service
+from utils.id_utils import is_uuid
 import asyncio
 import time
 
@@ -56,7 +57,8 @@ async def retry_database_operation(operation_func, max_retries=None, delay=None)
 async def get_user_by_id(user_id: str) -> Optional[Dict[str, Any]]:
     """Get user by ID with retry logic"""
     async def _operation():
-        result = supabase.table("users").select("*").eq("id", user_id).execute()
+        query = supabase.table("users").select("*").eq("id", user_id)
+        result = await asyncio.to_thread(query.execute)
         if result.data:
             return result.data[0]
         return None
@@ -88,7 +90,8 @@ async def create_user(user_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
 async def get_user_by_email(email: str) -> Optional[Dict[str, Any]]:
     """Get user by email with retry logic"""
     async def _operation():
-        result = supabase.table("users").select("*").eq("email", email).execute()
+        query = supabase.table("users").select("*").eq("email", email)
+        result = await asyncio.to_thread(query.execute)
         if result.data:
             return result.data[0]
         return None
@@ -121,7 +124,8 @@ async def get_user_by_email_with_login_retry(email: str) -> Optional[Dict[str, A
 async def get_user_by_username(username: str) -> Optional[Dict[str, Any]]:
     """Get user by username with retry logic"""
     async def _operation():
-        result = supabase.table("users").select("*").eq("username", username).execute()
+        query = supabase.table("users").select("*").eq("username", username)
+        result = await asyncio.to_thread(query.execute)
         if result.data:
             return result.data[0]
         return None
@@ -132,12 +136,63 @@ async def get_user_by_username(username: str) -> Optional[Dict[str, Any]]:
         print(f"❌ Error getting user by username after retries: {e}")
         return None
 
+def _postgrest_list(values: List[str]) -> str:
+    """Format values as a quoted PostgREST list, e.g. ("a","b")"""
+    quoted = ['"' + v.replace('\\', '\\\\').replace('"', '\\"') + '"' for v in values]
+    return "(" + ",".join(quoted) + ")"
+
+async def get_users_by_identifiers(identifiers: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Resolve user IDs, emails or usernames to users with a single query.
+    
+    Returns a dict keyed by the original identifier; identifiers that match
+    nothing are absent. Precedence per identifier is ID, then email, then username.
+    """
+    if not identifiers:
+        return {}
+    
+    unique_identifiers = list(dict.fromkeys(identifiers))
+    user_ids = [i for i in unique_identifiers if is_uuid(i)]
+    # Stored emails are lowercase, like the ones login and signup look up
+    emails = list(dict.fromkeys(i.lower() for i in unique_identifiers))
+    
+    filters = [
+        f"email.in.{_postgrest_list(emails)}",
+        f"username.in.{_postgrest_list(unique_identifiers)}"
+    ]
+    if user_ids:
+        # Only UUID-shaped values may be compared against the uuid id column
+        filters.insert(0, f"id.in.{_postgrest_list(user_ids)}")
+    
+    async def _operation():
+        query = supabase.table("users").select("*").or_(",".join(filters))
+        result = await asyncio.to_thread(query.execute)
+        return result.data or []
+    
+    try:
+        rows = await retry_database_operation(_operation)
+    except Exception as e:
+        print(f"❌ Error getting users by identifiers after retries: {e}")
+        return {}
+    
+    by_id = {row["id"].lower(): row for row in rows}
+    by_email = {row["email"].lower(): row for row in rows}
+    by_username = {row["username"]: row for row in rows}
+    
+    users = {}
+    for identifier in unique_identifiers:
+        user = by_id.get(identifier.lower()) or by_email.get(identifier.lower()) or by_username.get(identifier)
+        if user:
+            users[identifier] = user
+    return users
+
 async def update_last_login(user_id: str):
     """Update user's last login timestamp"""
     try:
-        supabase.table("users").update({
+        query = supabase.table("users").update({
             "last_login": datetime.utcnow().isoformat()
-        }).eq("id", user_id).execute()
+        }).eq("id", user_id)
+        # Run the blocking HTTP call off the event loop so it can overlap other writes
+        await asyncio.to_thread(query.execute)
         
     except Exception as e:
         print(f"Error updating last login: {e}")
@@ -155,7 +210,8 @@ async def create_user_session(user_id: str, token_hash: str, expires_at: datetim
             "created_at": datetime.utcnow().isoformat()
         }
         
-        result = supabase.table("user_sessions").insert(session_data).execute()
+        query = supabase.table("user_sessions").insert(session_data)
+        result = await asyncio.to_thread(query.execute)
         return bool(result.data)
         
     except Exception as e:
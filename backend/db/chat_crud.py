@@ -1,33 +1,15 @@
 from supabase import create_client, Client
-from typing import List, Optional, Dict, Any, Tuple
+from typing import List, Optional, Dict, Any, Iterable, Tuple
 from datetime import datetime
+import asyncio
 import os
+import re
 from .database import supabase
 from models.chat import MessageType, ChatRoomType, MessageStatus, UserRole
 
 class ChatCRUD:
     """CRUD operations for chat functionality integrated with existing file system"""
     
-    # ✅ CONNECTION UTILITIES
-    
-    @staticmethod
-    async def _warm_connection():
-        """Warm up database connection to prevent initial timeouts"""
-        try:
-            import asyncio
-            
-            async def ping_db():
-                # Simple ping query to warm up connection
-                result = supabase.table("users").select("id").limit(1).execute()
-                return result
-            
-            # Quick 2-second timeout for warm-up
-            await asyncio.wait_for(ping_db(), timeout=2.0)
-            
-        except Exception as e:
-            # Don't fail if warm-up fails, just log it
-            print(f"🔧 CRUD WARNING: Connection warm-up failed (continuing anyway): {e}")
-    
     # ✅ CHAT ROOM OPERATIONS
     
     @staticmethod
@@ -40,22 +22,45 @@ class ChatCRUD:
                 "name": name
             }
             
-            result = supabase.table("chat_rooms").insert(room_data).execute()
+            query = supabase.table("chat_rooms").insert(room_data)
+            result = await asyncio.to_thread(query.execute)
             if result.data and len(result.data) > 0:
                 return result.data[0]
             raise Exception("Failed to create chat room - no data returned")
         except Exception as e:
             raise Exception(f"Failed to create chat room: {str(e)}")
     
+    @staticmethod
+    async def create_chat_room_with_members(
+        creator_id: str,
+        room_type: str,
+        name: Optional[str],
+        member_ids: List[str]
+    ) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+        """Create a room, its admin and members in one transaction; returns (room, detailed members)"""
+        try:
+            query = supabase.rpc("create_chat_room_with_members", {
+                "p_creator_id": creator_id,
+                "p_room_type": room_type,
+                "p_room_name": name,
+                "p_member_ids": member_ids
+            })
+            result = await asyncio.to_thread(query.execute)
+            if result.data:
+                return result.data["room"], result.data["members"]
+            raise Exception("Failed to create chat room - no data returned")
+        except Exception as e:
+            raise Exception(f"Failed to create chat room: {str(e)}")
+    
     @staticmethod
     async def get_chat_room_by_id(room_id: str) -> Optional[Dict[str, Any]]:
         """Get chat room by ID"""
         try:
-            result = supabase.table("chat_rooms")\
+            query = supabase.table("chat_rooms")\
                 .select("*, users!created_by(username)")\
                 .eq("id", room_id)\
-                .single()\
-                .execute()
+                .single()
+            result = await asyncio.to_thread(query.execute)
             
             return result.data if result.data else None
         except Exception:
@@ -68,10 +73,10 @@ class ChatCRUD:
             print(f"🔍 Looking for direct chat between {user1_id[:8]}... and {user2_id[:8]}...")
             
             # Get all direct rooms where user1 is a member
-            user1_rooms_result = supabase.table("chat_room_members")\
+            user1_rooms_query = supabase.table("chat_room_members")\
                 .select("room_id")\
-                .eq("user_id", user1_id)\
-                .execute()
+                .eq("user_id", user1_id)
+            user1_rooms_result = await asyncio.to_thread(user1_rooms_query.execute)
             
             if not user1_rooms_result.data:
                 print("❌ User1 has no rooms")
@@ -81,10 +86,10 @@ class ChatCRUD:
             print(f"🏠 User1 has {len(user1_room_ids)} rooms")
             
             # Get all direct rooms where user2 is a member
-            user2_rooms_result = supabase.table("chat_room_members")\
+            user2_rooms_query = supabase.table("chat_room_members")\
                 .select("room_id")\
-                .eq("user_id", user2_id)\
-                .execute()
+                .eq("user_id", user2_id)
+            user2_rooms_result = await asyncio.to_thread(user2_rooms_query.execute)
             
             if not user2_rooms_result.data:
                 print("❌ User2 has no rooms")
@@ -105,19 +110,19 @@ class ChatCRUD:
                 print(f"🔍 Checking room {room_id[:8]}...")
                 
                 # Get room details
-                room_result = supabase.table("chat_rooms")\
+                room_query = supabase.table("chat_rooms")\
                     .select("*, users!created_by(username)")\
                     .eq("id", room_id)\
                     .eq("type", "direct")\
-                    .single()\
-                    .execute()
+                    .single()
+                room_result = await asyncio.to_thread(room_query.execute)
                 
                 if room_result.data:
                     # Count members in this room
-                    members_result = supabase.table("chat_room_members")\
+                    members_query = supabase.table("chat_room_members")\
                         .select("user_id")\
-                        .eq("room_id", room_id)\
-                        .execute()
+                        .eq("room_id", room_id)
+                    members_result = await asyncio.to_thread(members_query.execute)
                     
                     if len(members_result.data) == 2:
                         print(f"✅ Found direct chat room: {room_id[:8]}...")
@@ -145,7 +150,8 @@ class ChatCRUD:
                 for user_id in user_ids
             ]
             
-            result = supabase.table("chat_room_members").insert(members_data).execute()
+            query = supabase.table("chat_room_members").insert(members_data)
+            result = await asyncio.to_thread(query.execute)
             return result.data is not None and len(result.data) == len(user_ids)
         except Exception as e:
             print(f"Error adding room members: {e}")
@@ -167,7 +173,8 @@ class ChatCRUD:
                 "role": role
             }
             
-            result = supabase.table("chat_room_members").insert(member_data).execute()
+            query = supabase.table("chat_room_members").insert(member_data)
+            result = await asyncio.to_thread(query.execute)
             success = result.data is not None and len(result.data) > 0
             
             if success:
@@ -185,10 +192,10 @@ class ChatCRUD:
         """Get all chat rooms for a user with last message and unread count"""
         try:
             # Get rooms where user is a member
-            result = supabase.table("chat_room_members")\
+            query = supabase.table("chat_room_members")\
                 .select("room_id, role, joined_at, chat_rooms(*, users!created_by(username))")\
-                .eq("user_id", user_id)\
-                .execute()
+                .eq("user_id", user_id)
+            result = await asyncio.to_thread(query.execute)
             
             rooms_with_info = []
             for member in result.data:
@@ -228,10 +235,10 @@ class ChatCRUD:
     async def get_room_members_detailed(room_id: str) -> List[Dict[str, Any]]:
         """Get detailed information about room members"""
         try:
-            result = supabase.table("chat_room_members")\
+            query = supabase.table("chat_room_members")\
                 .select("user_id, role, joined_at, users(username, email)")\
-                .eq("room_id", room_id)\
-                .execute()
+                .eq("room_id", room_id)
+            result = await asyncio.to_thread(query.execute)
             
             members = []
             for member in result.data:
@@ -253,37 +260,22 @@ class ChatCRUD:
     async def is_user_in_room(user_id: str, room_id: str) -> bool:
         """Check if a user is a member of a chat room with improved timeout handling"""
         try:
-            print(f"🔧 CRUD DEBUG: Checking membership for user_id={user_id}, room_id={room_id}")
-            
-            # Warm up connection first
-            try:
-                print(f"🔧 CRUD DEBUG: Warming up connection...")
-                await ChatCRUD._warm_connection()
-                print(f"🔧 CRUD DEBUG: Connection warmed up successfully")
-            except Exception as warm_error:
-                print(f"🔧 CRUD WARNING: Connection warm-up failed: {warm_error}")
-            
             # Enhanced retry logic with exponential backoff
             max_retries = 5
             for attempt in range(max_retries):
                 try:
-                    import asyncio
-                    
                     # Use asyncio timeout for better control
                     async def check_membership():
-                        result = supabase.table("chat_room_members")\
+                        query = supabase.table("chat_room_members")\
                             .select("user_id")\
                             .eq("user_id", user_id)\
-                            .eq("room_id", room_id)\
-                            .execute()
-                        return result
+                            .eq("room_id", room_id)
+                        return await asyncio.to_thread(query.execute)
                     
                     # 5 second timeout per attempt
                     result = await asyncio.wait_for(check_membership(), timeout=5.0)
                     
-                    is_member = len(result.data) > 0
-                    print(f"🔧 CRUD DEBUG: Membership check result: {is_member} (found {len(result.data)} records)")
-                    return is_member
+                    return len(result.data) > 0
                     
                 except asyncio.TimeoutError:
                     if attempt < max_retries - 1:
@@ -299,7 +291,6 @@ class ChatCRUD:
                     if "timeout" in str(e).lower() and attempt < max_retries - 1:
                         wait_time = min(2 ** attempt, 5)
                         print(f"🔧 CRUD WARNING: Membership check error, retrying in {wait_time}s ({attempt + 1}/{max_retries}): {e}")
-                        import asyncio
                         await asyncio.sleep(wait_time)
                         continue
                     else:
@@ -315,12 +306,12 @@ class ChatCRUD:
     async def get_user_role_in_room(user_id: str, room_id: str) -> Optional[str]:
         """Get a user's role in a chat room"""
         try:
-            result = supabase.table("chat_room_members")\
+            query = supabase.table("chat_room_members")\
                 .select("role")\
                 .eq("user_id", user_id)\
                 .eq("room_id", room_id)\
-                .single()\
-                .execute()
+                .single()
+            result = await asyncio.to_thread(query.execute)
             
             return result.data["role"] if result.data else None
         except Exception:
@@ -330,10 +321,10 @@ class ChatCRUD:
     async def get_room_member_ids(room_id: str) -> List[str]:
         """Get all member IDs for a chat room"""
         try:
-            result = supabase.table("chat_room_members")\
+            query = supabase.table("chat_room_members")\
                 .select("user_id")\
-                .eq("room_id", room_id)\
-                .execute()
+                .eq("room_id", room_id)
+            result = await asyncio.to_thread(query.execute)
             
             return [member["user_id"] for member in result.data]
         except Exception:
@@ -354,7 +345,8 @@ class ChatCRUD:
                 "reply_to_id": reply_to_id
             }
             
-            result = supabase.table("messages").insert(message_data).execute()
+            query = supabase.table("messages").insert(message_data)
+            result = await asyncio.to_thread(query.execute)
             if result.data and len(result.data) > 0:
                 message = result.data[0]
                 
@@ -369,8 +361,9 @@ class ChatCRUD:
     @staticmethod
     async def send_file_message(sender_id: str, room_id: str, file_session_id: int,
                               file_path: str, file_name: str, file_size: int, 
-                              file_hash: str, reply_to_id: Optional[str] = None) -> Dict[str, Any]:
-        """Send a file message linked to existing file upload system"""
+                              file_hash: str, reply_to_id: Optional[str] = None,
+                              verified: bool = False, tree_hash: Optional[str] = None) -> Dict[str, Any]:
+        """Send a file message; verified=True records that file_hash was checked as the file was written"""
         try:
             # Determine if it's an image or regular file
             image_extensions = {'.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp', '.svg'}
@@ -388,8 +381,13 @@ class ChatCRUD:
                 "file_hash": file_hash,  # ✅ USES EXISTING HASH VERIFICATION
                 "reply_to_id": reply_to_id
             }
+            if verified:
+                message_data["verified_at"] = datetime.utcnow().isoformat()
+            if tree_hash:
+                message_data["tree_hash"] = tree_hash
             
-            result = supabase.table("messages").insert(message_data).execute()
+            query = supabase.table("messages").insert(message_data)
+            result = await asyncio.to_thread(query.execute)
             if result.data and len(result.data) > 0:
                 message = result.data[0]
                 
@@ -402,61 +400,52 @@ class ChatCRUD:
             raise Exception(f"Failed to send file message: {str(e)}")
     
     @staticmethod
-    async def get_room_messages(room_id: str, limit: int = 50, offset: int = 0) -> List[Dict[str, Any]]:
-        """Get messages from a chat room with sender info and reply context"""
-        print(f"🔧 CRUD DEBUG: get_room_messages called for room_id={room_id}, limit={limit}, offset={offset}")
+    async def get_room_messages(
+        room_id: str, 
+        limit: int = 50, 
+        offset: int = 0, 
+        user_id: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """Get messages from a chat room with sender info, reply context and (optionally) the user's status"""
         try:
-            print(f"🔧 CRUD DEBUG: Executing Supabase query...")
             # Add retry logic for timeout issues with faster recovery
             max_retries = 5
             for attempt in range(max_retries):
                 try:
-                    # First try a simple count query to warm up the connection
-                    if attempt == 0:
-                        print(f"🔧 CRUD DEBUG: Warming up connection...")
-                        try:
-                            count_result = supabase.table("messages")\
-                                .select("id", count="exact")\
-                                .eq("room_id", room_id)\
-                                .limit(1)\
-                                .execute()
-                            print(f"🔧 CRUD DEBUG: Connection warmed up successfully")
-                        except:
-                            print(f"🔧 CRUD WARNING: Connection warmup failed, proceeding anyway...")
-                    
-                    # Main query with extended join syntax
-                    print(f"🔧 CRUD DEBUG: Executing main query (attempt {attempt + 1})...")
-                    result = supabase.table("messages")\
-                        .select("*, sender:users(username)")\
-                        .eq("room_id", room_id)\
+                    # Main query with extended join syntax; the user's own status rows
+                    # are embedded so no per-page status lookup is needed
+                    columns = "*, sender:users(username)"
+                    if user_id:
+                        columns += ", message_status(status)"
+                    query = supabase.table("messages")\
+                        .select(columns)\
+                        .eq("room_id", room_id)
+                    if user_id:
+                        query = query.eq("message_status.user_id", user_id)
+                    query = query\
                         .order("created_at", desc=False)\
-                        .range(offset, offset + limit - 1)\
-                        .execute()
-                    
-                    print(f"🔧 CRUD DEBUG: Query succeeded on attempt {attempt + 1}")
+                        .range(offset, offset + limit - 1)
+                    result = await asyncio.to_thread(query.execute)
                     break  # Success, exit retry loop
                     
                 except Exception as e:
                     if ("timeout" in str(e).lower() or "read operation timed out" in str(e).lower()) and attempt < max_retries - 1:
                         wait_time = 0.5 * (attempt + 1)  # Exponential backoff
                         print(f"🔧 CRUD WARNING: Query timeout, retrying in {wait_time}s ({attempt + 1}/{max_retries})...")
-                        import time
-                        time.sleep(wait_time)
+                        await asyncio.sleep(wait_time)
                         continue
                     else:
                         print(f"🔧 CRUD ERROR: Query failed permanently: {e}")
                         raise  # Re-raise if not timeout or max retries reached
             
-            print(f"🔧 CRUD DEBUG: Supabase returned {len(result.data) if result.data else 0} raw messages")
-            if result.data:
-                print(f"🔧 CRUD DEBUG: First raw message keys: {list(result.data[0].keys()) if result.data else 'None'}")
-                print(f"🔧 CRUD DEBUG: Sender data: {result.data[0].get('sender') if result.data else 'None'}")
+            # Load every replied-to message on the page in one query
+            replies = await ChatCRUD.get_messages_by_ids(
+                {msg["reply_to_id"] for msg in result.data if msg.get("reply_to_id")}
+            )
             
             messages = []
-            for i, msg in enumerate(result.data):
-                # Debug sender information
+            for msg in result.data:
                 sender_info = msg.get("sender")
-                print(f"🔧 CRUD DEBUG: Message {i} sender info: {sender_info}")
                 
                 # Format the message with sender username
                 message = {
@@ -464,18 +453,17 @@ class ChatCRUD:
                     "sender_username": sender_info["username"] if sender_info and isinstance(sender_info, dict) else "Unknown"
                 }
                 
-                # Format reply information if present
-                if msg.get("reply_to"):
-                    reply = msg["reply_to"]
-                    message["reply_to"] = {
-                        **reply,
-                        "sender_username": reply["sender"]["username"] if reply.get("sender") else "Unknown"
-                    }
+                if user_id:
+                    statuses = message.pop("message_status", None) or []
+                    message["my_status"] = statuses[0]["status"] if statuses else None
+                
+                # Attach reply information if present
+                reply = replies.get(msg.get("reply_to_id"))
+                if reply:
+                    message["reply_to"] = reply
                 
                 messages.append(message)
-                print(f"🔧 CRUD DEBUG: Processed message {i+1}: ID={message.get('id', 'N/A')}, Content='{message.get('content', 'N/A')[:50]}'")
             
-            print(f"🔧 CRUD DEBUG: Returning {len(messages)} processed messages")
             return messages
         except Exception as e:
             print(f"🔧 CRUD ERROR: Error getting room messages: {e}")
@@ -487,11 +475,11 @@ class ChatCRUD:
     async def get_message_by_id(message_id: str) -> Optional[Dict[str, Any]]:
         """Get a specific message by ID"""
         try:
-            result = supabase.table("messages")\
+            query = supabase.table("messages")\
                 .select("*, sender:users!sender_id(username)")\
                 .eq("id", message_id)\
-                .single()\
-                .execute()
+                .single()
+            result = await asyncio.to_thread(query.execute)
             
             if result.data:
                 message = result.data
@@ -502,16 +490,37 @@ class ChatCRUD:
             print(f"🔧 ERROR: get_message_by_id failed: {e}")
             return None
     
+    @staticmethod
+    async def get_messages_by_ids(message_ids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        """Get several messages with sender usernames in one query, keyed by message ID"""
+        message_ids = list(message_ids)
+        if not message_ids:
+            return {}
+        try:
+            query = supabase.table("messages")\
+                .select("*, sender:users!sender_id(username)")\
+                .in_("id", message_ids)
+            result = await asyncio.to_thread(query.execute)
+            
+            messages = {}
+            for message in result.data or []:
+                message["sender_username"] = message["sender"]["username"] if message.get("sender") else "Unknown"
+                messages[message["id"]] = message
+            return messages
+        except Exception as e:
+            print(f"🔧 ERROR: get_messages_by_ids failed: {e}")
+            return {}
+    
     @staticmethod
     async def get_last_message_for_room(room_id: str) -> Optional[Dict[str, Any]]:
         """Get the last message sent in a room"""
         try:
-            result = supabase.table("messages")\
+            query = supabase.table("messages")\
                 .select("*, sender:users!sender_id(username)")\
                 .eq("room_id", room_id)\
                 .order("created_at", desc=True)\
-                .limit(1)\
-                .execute()
+                .limit(1)
+            result = await asyncio.to_thread(query.execute)
             
             if result.data and len(result.data) > 0:
                 message = result.data[0]
@@ -536,25 +545,46 @@ class ChatCRUD:
             }
             
             # Use upsert to handle duplicate entries
-            result = supabase.table("message_status")\
-                .upsert(status_data, on_conflict="message_id,user_id")\
-                .execute()
+            query = supabase.table("message_status")\
+                .upsert(status_data, on_conflict="message_id,user_id")
+            result = await asyncio.to_thread(query.execute)
             
             return result.data is not None
         except Exception as e:
             print(f"Error marking message status: {e}")
             return False
     
+    @staticmethod
+    async def mark_message_status_bulk(message_id: str, user_ids: List[str], status: str) -> bool:
+        """Mark one message's status for many users with a single upsert"""
+        if not user_ids:
+            return True
+        try:
+            timestamp = datetime.utcnow().isoformat()
+            rows = [
+                {"message_id": message_id, "user_id": user_id, "status": status, "timestamp": timestamp}
+                for user_id in user_ids
+            ]
+            
+            query = supabase.table("message_status")\
+                .upsert(rows, on_conflict="message_id,user_id")
+            result = await asyncio.to_thread(query.execute)
+            
+            return result.data is not None
+        except Exception as e:
+            print(f"Error marking message statuses: {e}")
+            return False
+    
     @staticmethod
     async def get_message_status(message_id: str, user_id: str) -> Optional[str]:
         """Get message status for a specific user"""
         try:
-            result = supabase.table("message_status")\
+            query = supabase.table("message_status")\
                 .select("status")\
                 .eq("message_id", message_id)\
                 .eq("user_id", user_id)\
-                .single()\
-                .execute()
+                .single()
+            result = await asyncio.to_thread(query.execute)
             
             return result.data["status"] if result.data else None
         except Exception:
@@ -565,11 +595,11 @@ class ChatCRUD:
         """Get count of unread messages in a room for a user"""
         try:
             # Get all messages in the room
-            messages_result = supabase.table("messages")\
+            messages_query = supabase.table("messages")\
                 .select("id")\
                 .eq("room_id", room_id)\
-                .neq("sender_id", user_id)\
-                .execute()
+                .neq("sender_id", user_id)
+            messages_result = await asyncio.to_thread(messages_query.execute)
             
             if not messages_result.data:
                 return 0
@@ -577,12 +607,12 @@ class ChatCRUD:
             message_ids = [msg["id"] for msg in messages_result.data]
             
             # Get read messages for this user
-            read_result = supabase.table("message_status")\
+            read_query = supabase.table("message_status")\
                 .select("message_id")\
                 .eq("user_id", user_id)\
                 .eq("status", MessageStatus.READ.value)\
-                .in_("message_id", message_ids)\
-                .execute()
+                .in_("message_id", message_ids)
+            read_result = await asyncio.to_thread(read_query.execute)
             
             read_message_ids = {msg["message_id"] for msg in read_result.data}
             
@@ -599,25 +629,26 @@ class ChatCRUD:
         """Mark all messages in a room as read for a user"""
         try:
             # Get all message IDs in the room (excluding user's own messages)
-            messages_result = supabase.table("messages")\
+            messages_query = supabase.table("messages")\
                 .select("id")\
                 .eq("room_id", room_id)\
-                .neq("sender_id", user_id)\
-                .execute()
+                .neq("sender_id", user_id)
+            messages_result = await asyncio.to_thread(messages_query.execute)
             
             if not messages_result.data:
                 return 0
             
-            # Mark all as read
-            marked_count = 0
-            for message in messages_result.data:
-                success = await ChatCRUD.mark_message_status(
-                    message["id"], user_id, MessageStatus.READ.value
-                )
-                if success:
-                    marked_count += 1
+            # Mark all as read with one upsert
+            timestamp = datetime.utcnow().isoformat()
+            rows = [
+                {"message_id": message["id"], "user_id": user_id, "status": MessageStatus.READ.value, "timestamp": timestamp}
+                for message in messages_result.data
+            ]
+            query = supabase.table("message_status")\
+                .upsert(rows, on_conflict="message_id,user_id")
+            result = await asyncio.to_thread(query.execute)
             
-            return marked_count
+            return len(result.data) if result.data else 0
         except Exception as e:
             print(f"Error marking room messages as read: {e}")
             return 0
@@ -628,30 +659,44 @@ class ChatCRUD:
     async def link_file_session_to_chat(file_session_id: int, room_id: str) -> bool:
         """Link an existing file session to a chat room"""
         try:
-            result = supabase.table("file_sessions")\
+            query = supabase.table("file_sessions")\
                 .update({
                     "upload_type": "chat",
                     "chat_room_id": room_id
                 })\
-                .eq("id", file_session_id)\
-                .execute()
+                .eq("id", file_session_id)
+            result = await asyncio.to_thread(query.execute)
             
             return result.data is not None
         except Exception as e:
             print(f"Error linking file session to chat: {e}")
             return False
     
+    @staticmethod
+    async def mark_file_verified(message_id: str) -> bool:
+        """Record a successful integrity check for a file message"""
+        try:
+            query = supabase.table("messages")\
+                .update({"verified_at": datetime.utcnow().isoformat()})\
+                .eq("id", message_id)
+            result = await asyncio.to_thread(query.execute)
+            
+            return bool(result.data)
+        except Exception as e:
+            print(f"Error marking file as verified: {e}")
+            return False
+    
     @staticmethod
     async def get_chat_files_for_room(room_id: str, limit: int = 50) -> List[Dict[str, Any]]:
         """Get all files shared in a chat room"""
         try:
-            result = supabase.table("messages")\
+            query = supabase.table("messages")\
                 .select("*, users!sender_id(username)")\
                 .eq("room_id", room_id)\
                 .in_("message_type", [MessageType.FILE.value, MessageType.IMAGE.value])\
                 .order("created_at", desc=True)\
-                .limit(limit)\
-                .execute()
+                .limit(limit)
+            result = await asyncio.to_thread(query.execute)
             
             files = []
             for msg in result.data:
@@ -676,26 +721,23 @@ class ChatCRUD:
     
     @staticmethod
     async def search_messages(room_id: str, query: str, limit: int = 20) -> List[Dict[str, Any]]:
-        """Search for messages in a room"""
+        """Search for messages in a room through the full-text index (see search_room_messages in the schema)"""
         try:
-            # Note: This is a basic search. For production, consider using full-text search
-            result = supabase.table("messages")\
-                .select("*, users!sender_id(username)")\
-                .eq("room_id", room_id)\
-                .ilike("content", f"%{query}%")\
-                .order("created_at", desc=True)\
-                .limit(limit)\
-                .execute()
-            
-            messages = []
-            for msg in result.data:
-                message = {
-                    **msg,
-                    "sender_username": msg["users"]["username"] if msg["users"] else "Unknown"
-                }
-                messages.append(message)
-            
-            return messages
+            # Match every word as a prefix; only word characters reach to_tsquery.
+            # A query of stopwords or no words at all falls back to a substring match on query
+            words = re.findall(r"\w+", query)
+            ts_query = " & ".join(f"{word}:*" for word in words)
+            
+            search_query = supabase.rpc("search_room_messages", {
+                "p_room_id": room_id,
+                "p_query": ts_query,
+                "p_limit": limit,
+                "p_text": query
+            })
+            result = await asyncio.to_thread(search_query.execute)
+            
+            # Rows already carry sender_username
+            return result.data or []
         except Exception as e:
             print(f"Error searching messages: {e}")
             return []
@@ -704,24 +746,28 @@ class ChatCRUD:
     async def get_room_statistics(room_id: str) -> Dict[str, Any]:
         """Get statistics for a chat room"""
         try:
-            # Get total message count
-            messages_result = supabase.table("messages")\
+            # Total message count
+            messages_query = supabase.table("messages")\
                 .select("id", count="exact")\
-                .eq("room_id", room_id)\
-                .execute()
+                .eq("room_id", room_id)
             
-            # Get file count
-            files_result = supabase.table("messages")\
+            # File count
+            files_query = supabase.table("messages")\
                 .select("id", count="exact")\
                 .eq("room_id", room_id)\
-                .in_("message_type", [MessageType.FILE.value, MessageType.IMAGE.value])\
-                .execute()
+                .in_("message_type", [MessageType.FILE.value, MessageType.IMAGE.value])
             
-            # Get member count
-            members_result = supabase.table("chat_room_members")\
+            # Member count
+            members_query = supabase.table("chat_room_members")\
                 .select("id", count="exact")\
-                .eq("room_id", room_id)\
-                .execute()
+                .eq("room_id", room_id)
+            
+            # The three counts are independent, so run them concurrently
+            messages_result, files_result, members_result = await asyncio.gather(
+                asyncio.to_thread(messages_query.execute),
+                asyncio.to_thread(files_query.execute),
+                asyncio.to_thread(members_query.execute)
+            )
             
             return {
                 "total_messages": messages_result.count or 0,
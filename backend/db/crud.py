@@ -1,7 +1,11 @@
+import asyncio
+import logging
 from datetime import datetime
 from typing import Optional, List, Dict, Any
 from db.database import supabase
 
+logger = logging.getLogger(__name__)
+
 async def create_file_session(
     file_id: str, 
     filename: str, 
@@ -64,27 +68,28 @@ async def get_user_by_id(user_id: str) -> Optional[Dict[str, Any]]:
 def get_file_session(file_id: str) -> Optional[Dict[str, Any]]:
     """Get file session by ID"""
     try:
-        print(f"DEBUG: Looking for file session with ID: {file_id}")  # Debug logging
+        logger.debug("Looking for file session with ID: %s", file_id)
         result = supabase.table("file_sessions").select("*").eq("file_id", file_id).execute()
-        print(f"DEBUG: Database query result: {result.data}")  # Debug logging
+        logger.debug("Database query result: %s", result.data)
         
         if result.data:
             return result.data[0]
         else:
-            print(f"DEBUG: No file session found for ID: {file_id}")
+            logger.debug("No file session found for ID: %s", file_id)
             return None
     except Exception as e:
         print(f"Database error in get_file_session: {e}")
-        print(f"DEBUG: Full exception details: {type(e).__name__}: {str(e)}")
+        logger.debug("Full exception details", exc_info=True)
         return None  # Return None instead of mock data to see real errors
 
 async def update_upload_progress(
     file_id: str, 
     uploaded_chunks: int, 
     total_chunks: int, 
-    status: str = "uploading"
+    status: str = "uploading",
+    monotonic: bool = False
 ) -> bool:
-    """Update upload progress and status"""
+    """Update upload progress and status; monotonic=True never lowers the stored count"""
     update_data = {
         "uploaded_chunks": uploaded_chunks,
         "status": status,
@@ -93,7 +98,12 @@ async def update_upload_progress(
     }
     
     try:
-        result = supabase.table("file_sessions").update(update_data).eq("file_id", file_id).execute()
+        query = supabase.table("file_sessions").update(update_data).eq("file_id", file_id)
+        if monotonic:
+            # Concurrent chunk requests may finish out of order; a single conditional
+            # UPDATE keeps a late, smaller count from overwriting a newer one
+            query = query.lt("uploaded_chunks", uploaded_chunks)
+        result = await asyncio.to_thread(query.execute)
         return bool(result.data)
     except Exception as e:
         print(f"Database error in update_upload_progress: {e}")
@@ -109,14 +119,38 @@ async def mark_chunk_uploaded(file_id: str, chunk_number: int) -> bool:
     }
     
     try:
-        # Use upsert to handle duplicate chunk uploads
-        result = supabase.table("uploaded_chunks").upsert(chunk_data).execute()
+        # A re-sent chunk is a no-op (ON CONFLICT (file_id, chunk_number) DO NOTHING)
+        query = supabase.table("uploaded_chunks").upsert(
+            chunk_data, on_conflict="file_id,chunk_number", ignore_duplicates=True
+        )
+        result = await asyncio.to_thread(query.execute)
         return bool(result.data)
     except Exception as e:
         print(f"Database error in mark_chunk_uploaded: {e}")
         # Return True to allow upload to continue even if database fails
         return True
 
+async def mark_chunks_uploaded(file_id: str, chunk_numbers: List[int]) -> bool:
+    """Mark several chunks as uploaded in a single upsert"""
+    if not chunk_numbers:
+        return True
+    uploaded_at = datetime.utcnow().isoformat()
+    chunk_rows = [
+        {"file_id": file_id, "chunk_number": chunk_number, "uploaded_at": uploaded_at}
+        for chunk_number in chunk_numbers
+    ]
+    
+    try:
+        query = supabase.table("uploaded_chunks").upsert(
+            chunk_rows, on_conflict="file_id,chunk_number", ignore_duplicates=True
+        )
+        result = await asyncio.to_thread(query.execute)
+        return bool(result.data)
+    except Exception as e:
+        print(f"Database error in mark_chunks_uploaded: {e}")
+        # Return True to allow upload to continue even if database fails
+        return True
+
 def get_uploaded_chunk_numbers(file_id: str) -> List[int]:
     """Get list of successfully uploaded chunk numbers"""
     try:
@@ -1,5 +1,6 @@
 from fastapi import FastAPI, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 import asyncio
 from contextlib import asynccontextmanager
 
@@ -10,11 +11,13 @@ from routers import chat  # ✅ ADD CHAT ROUTER
 from services.chunk_service import chunk_service
 from db.crud import cleanup_failed_sessions
 from config import settings
+from utils.hash_utils import describe_sha256_backend
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
     print("Starting Smart File Transfer Backend...")
+    print(describe_sha256_backend())
     
     # Warm up database connections
     try:
@@ -62,7 +65,8 @@ app = FastAPI(
     title="Smart File Transfer with Chat API",
     description="Robust file transfer system with chunk-based uploads and real-time chat for unstable networks",
     version="3.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
 # CORS middleware
@@ -76,6 +80,8 @@ app.add_middleware(
 
 # Include routers
 app.include_router(auth.router)  # Add authentication routes
+if settings.DEBUG:
+    app.include_router(auth.debug_router)  # Debug-only auth endpoints
 app.include_router(upload.router)
 app.include_router(chat.router)  # ✅ ADD CHAT ROUTES
 app.include_router(websocket.router)  # Add WebSocket routes
@@ -146,4 +152,7 @@ async def speed_test(size_kb: int):
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # The event loop uvicorn picks (uvloop when installed) already sets TCP_NODELAY
+    # on every accepted TCP socket, so small frames go out immediately; per-message
+    # deflate only costs CPU on the short JSON frames these WebSockets carry
+    uvicorn.run(app, host="0.0.0.0", port=8000, ws_per_message_deflate=False)
@@ -2,6 +2,16 @@ from pydantic import BaseModel, EmailStr, Field, validator
 from typing import Optional
 from datetime import datetime
 import re
+import sys
+
+USERNAME_PATTERN = re.compile(r'^[a-zA-Z0-9_-]+$')
+BCRYPT_MAX_PASSWORD_BYTES = 72
+
+def check_bcrypt_length(password: str) -> str:
+    """Reject passwords bcrypt would silently truncate"""
+    if len(password.encode('utf-8')) > BCRYPT_MAX_PASSWORD_BYTES:
+        raise ValueError('Password cannot exceed 72 bytes (bcrypt limitation)')
+    return password
 
 class UserCreate(BaseModel):
     email: EmailStr
@@ -10,9 +20,13 @@ class UserCreate(BaseModel):
     first_name: Optional[str] = Field(None, max_length=100)
     last_name: Optional[str] = Field(None, max_length=100)
     
+    @validator('email')
+    def normalize_email(cls, v):
+        return v.lower()
+    
     @validator('username')
     def validate_username(cls, v):
-        if not re.match(r'^[a-zA-Z0-9_-]+$', v):
+        if not USERNAME_PATTERN.match(v):
             raise ValueError('Username can only contain letters, numbers, underscores, and hyphens')
         return v
     
@@ -20,8 +34,7 @@ class UserCreate(BaseModel):
     def validate_password(cls, v):
         if len(v) < 8:
             raise ValueError('Password must be at least 8 characters long')
-        if len(v.encode('utf-8')) > 72:
-            raise ValueError('Password cannot exceed 72 bytes (bcrypt limitation)')
+        check_bcrypt_length(v)
         # Temporarily simplified validation for testing
         # if not re.search(r'[A-Z]', v):
         #     raise ValueError('Password must contain at least one uppercase letter')
@@ -36,6 +49,11 @@ class UserCreate(BaseModel):
 class UserLogin(BaseModel):
     email: EmailStr
     password: str
+    
+    @validator('email')
+    def normalize_email(cls, v):
+        # Interned so the in-memory login attempt store hashes a shared key
+        return sys.intern(v.lower())
 
 class UserResponse(BaseModel):
     id: str
@@ -57,14 +75,26 @@ class TokenResponse(BaseModel):
 
 class PasswordReset(BaseModel):
     email: EmailStr
+    
+    @validator('email')
+    def normalize_email(cls, v):
+        return v.lower()
 
 class PasswordResetConfirm(BaseModel):
     token: str
     new_password: str = Field(..., min_length=8, max_length=128)
+    
+    @validator('new_password')
+    def validate_new_password(cls, v):
+        return check_bcrypt_length(v)
 
 class ChangePassword(BaseModel):
     current_password: str
     new_password: str = Field(..., min_length=8, max_length=128)
+    
+    @validator('new_password')
+    def validate_new_password(cls, v):
+        return check_bcrypt_length(v)
 
 class RefreshTokenRequest(BaseModel):
     refresh_token: str
\ No newline at end of file
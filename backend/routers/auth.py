@@ -1,5 +1,6 @@
 from fastapi import APIRouter, HTTPException, status, Depends, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, ORJSONResponse
+import asyncio
 from datetime import datetime, timedelta
 from typing import Dict, Any
 
@@ -17,33 +18,41 @@ from db.auth_crud import (
 from dependencies.auth import get_current_user, get_current_active_user
 from config import settings
 
-router = APIRouter(prefix="/auth", tags=["Authentication"])
+router = APIRouter(prefix="/auth", tags=["Authentication"], default_response_class=ORJSONResponse)
 
-@router.post("/test-signup")
+def build_token_response(tokens: Dict[str, Any], user: Dict[str, Any]) -> ORJSONResponse:
+    """Serialize a TokenResponse with orjson, skipping FastAPI's second response_model pass"""
+    token_response = TokenResponse(**tokens, user=UserResponse(**user))
+    return ORJSONResponse(content=token_response.model_dump())
+
+# Debug-only endpoints, mounted by main.py when settings.DEBUG is enabled
+debug_router = APIRouter(prefix="/auth", tags=["Authentication Debug"])
+
+@debug_router.post("/test-signup")
 async def test_signup(user_data: UserCreate):
     """Debug endpoint to test data validation"""
     try:
         return {
-            "received_data": user_data.dict(), 
+            "received_data": user_data.model_dump(), 
             "status": "validation_success",
             "message": "Data validation passed - database tables may be missing"
         }
     except Exception as e:
         return {"error": str(e), "status": "validation_error"}
 
-@router.post("/test-login")
+@debug_router.post("/test-login")
 async def test_login(login_data: UserLogin):
     """Debug endpoint to test login data validation"""
     try:
         return {
-            "received_data": login_data.dict(), 
+            "received_data": login_data.model_dump(), 
             "status": "validation_success",
             "message": "Login data validation passed"
         }
     except Exception as e:
         return {"error": str(e), "status": "validation_error"}
 
-@router.get("/debug/verify-token")
+@debug_router.get("/debug/verify-token")
 async def debug_verify_token(current_user: dict = Depends(get_current_active_user)):
     """Debug endpoint to verify token is working"""
     return {
@@ -58,6 +67,10 @@ async def debug_verify_token(current_user: dict = Depends(get_current_active_use
 @router.post("/signup", response_model=TokenResponse)
 async def signup(user_data: UserCreate, request: Request):
     """Register a new user"""
+    # Capture request metadata once, before any awaits
+    user_agent = request.headers.get("user-agent")
+    client = request.client
+    ip_address = client.host if client else None
     try:
         # Check if email already exists
         existing_user = await get_user_by_email(user_data.email)
@@ -76,7 +89,7 @@ async def signup(user_data: UserCreate, request: Request):
             )
         
         # Create user
-        user_dict = user_data.dict()
+        user_dict = user_data.model_dump()
         user_dict["is_active"] = True
         user_dict["is_verified"] = False
         created_user = await create_user(user_dict)
@@ -94,21 +107,19 @@ async def signup(user_data: UserCreate, request: Request):
         token_hash = auth_service.hash_token(tokens["refresh_token"])
         expires_at = datetime.utcnow() + timedelta(days=settings.REFRESH_TOKEN_EXPIRE_DAYS)
         
-        await create_user_session(
-            user_id=created_user["id"],
-            token_hash=token_hash,
-            expires_at=expires_at,
-            device_info=request.headers.get("User-Agent"),
-            ip_address=request.client.host if request.client else None
+        # Create session and update last login concurrently (independent writes)
+        await asyncio.gather(
+            create_user_session(
+                user_id=created_user["id"],
+                token_hash=token_hash,
+                expires_at=expires_at,
+                device_info=user_agent,
+                ip_address=ip_address
+            ),
+            update_last_login(created_user["id"])
         )
         
-        # Update last login
-        await update_last_login(created_user["id"])
-        
-        return TokenResponse(
-            **tokens,
-            user=UserResponse(**created_user)
-        )
+        return build_token_response(tokens, created_user)
         
     except HTTPException:
         raise
@@ -121,6 +132,10 @@ async def signup(user_data: UserCreate, request: Request):
 @router.post("/login", response_model=TokenResponse)
 async def login(login_data: UserLogin, request: Request):
     """Login user"""
+    # Capture request metadata once, before any awaits
+    user_agent = request.headers.get("user-agent")
+    client = request.client
+    ip_address = client.host if client else None
     try:
         # Check login attempts
         if not auth_service.check_login_attempts(login_data.email):
@@ -163,21 +178,19 @@ async def login(login_data: UserLogin, request: Request):
         token_hash = auth_service.hash_token(tokens["refresh_token"])
         expires_at = datetime.utcnow() + timedelta(days=settings.REFRESH_TOKEN_EXPIRE_DAYS)
         
-        await create_user_session(
-            user_id=user["id"],
-            token_hash=token_hash,
-            expires_at=expires_at,
-            device_info=request.headers.get("User-Agent"),
-            ip_address=request.client.host if request.client else None
+        # Create session and update last login concurrently (independent writes)
+        await asyncio.gather(
+            create_user_session(
+                user_id=user["id"],
+                token_hash=token_hash,
+                expires_at=expires_at,
+                device_info=user_agent,
+                ip_address=ip_address
+            ),
+            update_last_login(user["id"])
         )
         
-        # Update last login
-        await update_last_login(user["id"])
-        
-        return TokenResponse(
-            **tokens,
-            user=UserResponse(**user)
-        )
+        return build_token_response(tokens, user)
         
     except HTTPException:
         raise
@@ -211,7 +224,7 @@ async def refresh_token(refresh_data: RefreshTokenRequest):
     """Refresh access token"""
     try:
         # Verify refresh token
-        payload = auth_service.verify_token(refresh_data.refresh_token, "refresh")
+        payload = auth_service.verify_refresh_token(refresh_data.refresh_token)
         user_id = payload.get("sub")
         
         # Get user
@@ -225,10 +238,7 @@ async def refresh_token(refresh_data: RefreshTokenRequest):
         # Generate new tokens
         tokens = auth_service.generate_tokens(user)
         
-        return TokenResponse(
-            **tokens,
-            user=UserResponse(**user)
-        )
+        return build_token_response(tokens, user)
         
     except HTTPException:
         raise
@@ -306,6 +316,13 @@ async def change_password(
 ):
     """Change user password"""
     try:
+        # Cheap check first: avoids two bcrypt rounds on a no-op change
+        if password_data.new_password == password_data.current_password:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="New password must be different from the current password"
+            )
+        
         # Verify current password
         if not auth_service.verify_password(password_data.current_password, current_user["password_hash"]):
             raise HTTPException(
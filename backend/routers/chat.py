@@ -1,25 +1,132 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, BackgroundTasks, Request
+from fastapi.responses import Response
 from typing import List, Optional
 from models.chat import *
 from db.chat_crud import ChatCRUD
-from db.auth_crud import get_user_by_id, get_user_by_email
+from db.auth_crud import get_user_by_id, get_users_by_identifiers
+from db.crud import create_file_session
 from dependencies.auth import get_current_active_user
-from routers.websocket import chat_manager, notify_chat_file_progress, notify_chat_file_complete
-from utils.file_utils import save_upload_file, get_file_extension
+from config import settings
+from routers.upload import process_chunk_upload, complete_file_upload
+from routers.websocket import chat_manager, reply_preview, notify_chat_file_progress, notify_chat_file_complete
+from services.buffer_pool import buffer_pool
+from services.ws_coalescer import progress_coalescer
+from utils.file_utils import save_upload_file, get_file_extension, copy_upload_with_hash, delete_file_if_exists
 from utils.hash_utils import calculate_file_hash
+from utils.hash_cache import cached_verify
+from utils.download import file_download_response
+from utils.membership_cache import is_user_in_room_cached, get_user_role_cached, remember_membership
+from utils.session_cache import remember_file_session
+import aiofiles.os
+import asyncio
 import os
-import shutil
-import uuid
-import json
-from datetime import datetime
+import secrets
+import logging
+from datetime import datetime, timedelta, timezone
+from functools import partial
 
 router = APIRouter(prefix="/chat", tags=["chat"])
+logger = logging.getLogger(__name__)
+
+# Created once at startup by settings
+CHAT_FILES_DIR = str(settings.CHAT_FILES_DIR)
+
+# Plain dict lookups are cheaper than calling the Enum constructor per row
+MESSAGE_TYPES = {message_type.value: message_type for message_type in MessageType}
+MESSAGE_STATUSES = {status.value: status for status in MessageStatus}
+USER_ROLES = {role.value: role for role in UserRole}
+ROOM_TYPES = {room_type.value: room_type for room_type in ChatRoomType}
+
+
+async def fetch_if_member(user_id: str, room_id: str, fetch):
+    """Run a read-only room query alongside the membership check"""
+    is_member, data = await asyncio.gather(
+        is_user_in_room_cached(user_id, room_id),
+        fetch,
+        return_exceptions=True
+    )
+    if isinstance(is_member, BaseException):
+        raise is_member
+    if not is_member:
+        # Whatever the query returned is discarded for non-members
+        raise HTTPException(status_code=403, detail="Not a member of this room")
+    if isinstance(data, BaseException):
+        raise data
+    return data
+
+def to_datetime(value):
+    """Parse a stored timestamp, since model_construct skips Pydantic's coercion"""
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value)
+        except ValueError:
+            return value
+    return value
+
+def recently_verified(verified_at: Optional[str]) -> bool:
+    """Check whether a file's last integrity check is still fresh"""
+    if not verified_at:
+        return False
+    try:
+        checked = datetime.fromisoformat(verified_at)
+    except ValueError:
+        return False
+    if checked.tzinfo is not None:
+        checked = checked.astimezone(timezone.utc).replace(tzinfo=None)
+    return datetime.utcnow() - checked < timedelta(hours=settings.FILE_REVERIFY_HOURS)
+
+# Response builders for rows read back through ChatCRUD; the data is already
+# validated by the schema, so model_construct skips Pydantic's validators
+
+def member_from_row(m: dict) -> ChatRoomMember:
+    """Build a ChatRoomMember from a member row"""
+    return ChatRoomMember.model_construct(
+        user_id=m["user_id"],
+        username=m["username"],
+        role=USER_ROLES[m["role"]],
+        joined_at=to_datetime(m["joined_at"])
+    )
+
+def message_from_row(msg: dict, **extra) -> MessageResponse:
+    """Build a MessageResponse from a message row; extra sets reply_to/status"""
+    created_at = to_datetime(msg["created_at"])
+    return MessageResponse.model_construct(
+        id=msg["id"],
+        room_id=msg["room_id"],
+        sender_id=msg["sender_id"],
+        sender_username=msg.get("sender_username", "Unknown"),
+        message_type=MESSAGE_TYPES[msg["message_type"]],
+        content=msg.get("content"),
+        file_session_id=msg.get("file_session_id"),
+        file_path=msg.get("file_path"),
+        file_name=msg.get("file_name"),
+        file_size=msg.get("file_size"),
+        file_hash=msg.get("file_hash"),
+        created_at=created_at,
+        updated_at=to_datetime(msg["updated_at"]) if msg.get("updated_at") else created_at,
+        **extra
+    )
+
+def room_from_row(room: dict, members: List[dict], created_by_username: str, **extra) -> ChatRoomResponse:
+    """Build a ChatRoomResponse from a room row and its member rows"""
+    return ChatRoomResponse.model_construct(
+        id=room["id"],
+        name=room["name"],
+        type=ROOM_TYPES[room["type"]],
+        created_by=room["created_by"],
+        created_by_username=created_by_username,
+        members=[member_from_row(m) for m in members],
+        created_at=to_datetime(room["created_at"]),
+        updated_at=to_datetime(room["updated_at"]),
+        **extra
+    )
 
 # ✅ CHAT ROOM MANAGEMENT
 
 @router.post("/rooms", response_model=ChatRoomResponse)
 async def create_chat_room(
     request: CreateChatRoomRequest,
+    background_tasks: BackgroundTasks,
     current_user: dict = Depends(get_current_active_user)
 ):
     """Create a new chat room (direct or group chat)"""
@@ -28,64 +135,31 @@ async def create_chat_room(
         if request.type == ChatRoomType.GROUP and not request.name:
             raise HTTPException(status_code=400, detail="Group chats must have a name")
         
+        # Resolve all members with one batched lookup before doing anything else
+        users_by_identifier = await get_users_by_identifiers(request.members)
+        
         # ✅ FOR DIRECT CHATS: Check if room already exists between users
+        other_user = None
         if request.type == ChatRoomType.DIRECT and request.members:
-            print(f"🔍 Checking for existing direct chat between {current_user['username']} and {request.members}")
+            logger.debug("Checking for existing direct chat between %s and %s", current_user["username"], request.members)
             
             # Get the other user first
             member_identifier = request.members[0]
-            other_user = None
-            
-            # Try to find the other user
-            import re
-            uuid_pattern = r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$'
-            
-            if re.match(uuid_pattern, member_identifier, re.IGNORECASE):
-                try:
-                    other_user = await get_user_by_id(member_identifier)
-                except:
-                    pass
-            
-            if not other_user:
-                try:
-                    other_user = await get_user_by_email(member_identifier)
-                except:
-                    pass
-                    
-            if not other_user:
-                try:
-                    from db.auth_crud import get_user_by_username
-                    other_user = await get_user_by_username(member_identifier)
-                except:
-                    pass
+            other_user = users_by_identifier.get(member_identifier)
             
             if other_user:
                 # Check if direct chat already exists
                 existing_room = await ChatCRUD.find_direct_chat_room(current_user["id"], other_user["id"])
                 if existing_room:
-                    print(f"✅ Found existing direct chat room: {existing_room['id']}")
+                    logger.debug("Found existing direct chat room %s", existing_room["id"])
                     
                     # Return existing room with member details
                     members = await ChatCRUD.get_room_members_detailed(existing_room["id"])
-                    return ChatRoomResponse(
-                        id=existing_room["id"],
-                        name=existing_room["name"],
-                        type=ChatRoomType(existing_room["type"]),
-                        created_by=existing_room["created_by"],
-                        created_by_username=existing_room.get("created_by_username", "Unknown"),
-                        members=[
-                            ChatRoomMember(
-                                user_id=m["user_id"],
-                                username=m["username"],
-                                role=UserRole(m["role"]),
-                                joined_at=m["joined_at"]
-                            ) for m in members
-                        ],
-                        created_at=existing_room["created_at"],
-                        updated_at=existing_room["updated_at"]
+                    return room_from_row(
+                        existing_room,
+                        members,
+                        existing_room.get("created_by_username", "Unknown")
                     )
-                else:
-                    print(f"🆕 No existing direct chat found, creating new room...")
             else:
                 raise HTTPException(status_code=404, detail=f"User not found: {member_identifier}")
         
@@ -93,161 +167,58 @@ async def create_chat_room(
         room_name = request.name
         if not room_name and request.type == ChatRoomType.DIRECT:
             # For direct chats, generate name from participants
-            if request.members:
-                member_identifier = request.members[0]
-                
-                # Try to get the other user's name
-                other_user = None
-                import re
-                uuid_pattern = r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$'
-                
-                if re.match(uuid_pattern, member_identifier, re.IGNORECASE):
-                    try:
-                        other_user = await get_user_by_id(member_identifier)
-                    except:
-                        pass
-                
-                if not other_user:
-                    try:
-                        other_user = await get_user_by_email(member_identifier)
-                    except:
-                        pass
-                        
-                if not other_user:
-                    try:
-                        from db.auth_crud import get_user_by_username
-                        other_user = await get_user_by_username(member_identifier)
-                    except:
-                        pass
-                
-                if other_user:
-                    room_name = f"{current_user['username']} & {other_user['username']}"
-                else:
-                    room_name = f"Direct Chat - {current_user['username']}"
+            if other_user:
+                room_name = f"{current_user['username']} & {other_user['username']}"
             else:
                 room_name = f"Direct Chat - {current_user['username']}"
         
-        # Create the room
-        room = await ChatCRUD.create_chat_room(
-            creator_id=current_user["id"],
-            room_type=request.type.value,
-            name=room_name
-        )
-        
-        # Add creator as admin
-        await ChatCRUD.add_room_members(room["id"], [current_user["id"]], role="admin")
-        
-        # Add other members with better error handling
         member_ids = []
         for member_identifier in request.members:
-            user = None
-            
-            # Check if it looks like a UUID (contains hyphens and is proper length)
-            import re
-            uuid_pattern = r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$'
-            
-            print(f"🔍 Looking up user: {member_identifier}")
-            
-            # Try multiple lookup methods with timeout handling
-            if re.match(uuid_pattern, member_identifier, re.IGNORECASE):
-                # Try as UUID first
-                try:
-                    user = await get_user_by_id(member_identifier)
-                    if user:
-                        print(f"✅ Found user by ID: {user['username']}")
-                except Exception as e:
-                    print(f"❌ ID lookup failed: {e}")
-            
-            if not user:
-                # Try as email with timeout handling
-                try:
-                    user = await get_user_by_email(member_identifier)
-                    if user:
-                        print(f"✅ Found user by email: {user['username']}")
-                except Exception as e:
-                    print(f"❌ Email lookup failed: {e}")
-                    
-            if not user:
-                # Try as username
-                try:
-                    from db.auth_crud import get_user_by_username
-                    user = await get_user_by_username(member_identifier)
-                    if user:
-                        print(f"✅ Found user by username: {user['username']}")
-                except Exception as e:
-                    print(f"❌ Username lookup failed: {e}")
-            
+            user = users_by_identifier.get(member_identifier)
             if user and user["id"] != current_user["id"]:
                 member_ids.append(user["id"])
-                print(f"✅ Added member: {user['username']}")
             elif not user:
                 # More specific error message
                 error_msg = f"User not found or database temporarily unavailable: {member_identifier}"
-                print(f"❌ {error_msg}")
+                logger.warning(error_msg)
                 raise HTTPException(
                     status_code=404, 
                     detail=error_msg
                 )
         
-        if member_ids:
-            success = await ChatCRUD.add_room_members(room["id"], member_ids)
-            if not success:
-                raise HTTPException(status_code=400, detail="Failed to add some members")
-        
-        # Get complete room info for response
-        members = await ChatCRUD.get_room_members_detailed(room["id"])
-        
-        room_response = ChatRoomResponse(
-            id=room["id"],
-            name=room["name"],
-            type=ChatRoomType(room["type"]),
-            created_by=room["created_by"],
-            created_by_username=current_user["username"],
-            members=[
-                ChatRoomMember(
-                    user_id=m["user_id"],
-                    username=m["username"],
-                    role=UserRole(m["role"]),
-                    joined_at=m["joined_at"]
-                ) for m in members
-            ],
-            created_at=room["created_at"],
-            updated_at=room["updated_at"]
+        # Create the room, add the creator as admin and the members, and read
+        # back member details in one transaction
+        room, members = await ChatCRUD.create_chat_room_with_members(
+            creator_id=current_user["id"],
+            room_type=request.type.value,
+            name=room_name,
+            member_ids=member_ids
         )
         
+        # New members usually post right away; skip their first membership query
+        for m in members:
+            remember_membership((m["user_id"],), room["id"], m["role"])
+        
+        room_response = room_from_row(room, members, current_user["username"])
+        
         # ✅ BROADCAST NEW ROOM TO ALL MEMBERS via General WebSocket
-        try:
-            print(f"📢 Broadcasting new room notification to {len(members)} members...")
-            from routers.websocket import chat_manager
-            from datetime import datetime
-            
-            # Create room notification
-            room_notification = {
-                "type": "new_room",
-                "room": {
-                    "id": room["id"],
-                    "name": room["name"],
-                    "type": room["type"],
-                    "created_by": current_user["username"],
-                    "member_count": len(members)
-                },
-                "timestamp": datetime.utcnow().isoformat()
-            }
-            
-            # Send notification to all room members via general chat WebSocket
-            for member in members:
-                member_id = member["user_id"]
-                if member_id in chat_manager.user_connections:
-                    for room_ws_id, websocket in chat_manager.user_connections[member_id].items():
-                        try:
-                            await websocket.send_text(json.dumps(room_notification))
-                            print(f"✅ Sent room notification to {member['username']}")
-                        except:
-                            print(f"❌ Failed to send room notification to {member['username']}")
-            
-        except Exception as e:
-            print(f"❌ Failed to broadcast room notification: {e}")
-            # Don't fail the request if notification fails
+        # Runs after the response is sent, so fan-out never delays room creation
+        room_notification = {
+            "type": "new_room",
+            "room": {
+                "id": room["id"],
+                "name": room["name"],
+                "type": room["type"],
+                "created_by": current_user["username"],
+                "member_count": len(members)
+            },
+            "timestamp": datetime.utcnow().isoformat()
+        }
+        background_tasks.add_task(
+            chat_manager.notify_users,
+            [m["user_id"] for m in members],
+            room_notification
+        )
         
         return room_response
         
@@ -267,47 +238,17 @@ async def get_user_chat_rooms(
         
         room_responses = []
         for room_data in rooms_data:
-            # Convert members to proper format
-            members = [
-                ChatRoomMember(
-                    user_id=m["user_id"],
-                    username=m["username"],
-                    role=UserRole(m["role"]),
-                    joined_at=m["joined_at"]
-                ) for m in room_data.get("members", [])
-            ]
-            
             # Convert last message if exists
             last_message = None
             if room_data.get("last_message"):
-                msg = room_data["last_message"]
-                last_message = MessageResponse(
-                    id=msg["id"],
-                    room_id=msg["room_id"],
-                    sender_id=msg["sender_id"],
-                    sender_username=msg.get("sender_username", "Unknown"),
-                    message_type=MessageType(msg["message_type"]),
-                    content=msg.get("content"),
-                    file_session_id=msg.get("file_session_id"),
-                    file_path=msg.get("file_path"),
-                    file_name=msg.get("file_name"),
-                    file_size=msg.get("file_size"),
-                    file_hash=msg.get("file_hash"),
-                    created_at=msg["created_at"],
-                    updated_at=msg.get("updated_at", msg["created_at"])
-                )
+                last_message = message_from_row(room_data["last_message"])
             
-            room_response = ChatRoomResponse(
-                id=room_data["id"],
-                name=room_data["name"],
-                type=ChatRoomType(room_data["type"]),
-                created_by=room_data["created_by"],
-                created_by_username=room_data.get("users", {}).get("username", "Unknown"),
-                members=members,
+            room_response = room_from_row(
+                room_data,
+                room_data.get("members", []),
+                room_data.get("users", {}).get("username", "Unknown"),
                 last_message=last_message,
-                unread_count=room_data.get("unread_count", 0),
-                created_at=room_data["created_at"],
-                updated_at=room_data["updated_at"]
+                unread_count=room_data.get("unread_count", 0)
             )
             room_responses.append(room_response)
         
@@ -324,18 +265,19 @@ async def get_chat_room(
 ):
     """Get detailed information about a specific chat room"""
     try:
-        # Check if user is member of the room
-        is_member = await ChatCRUD.is_user_in_room(current_user["id"], room_id)
-        if not is_member:
-            raise HTTPException(status_code=403, detail="Not a member of this room")
-        
-        room = await ChatCRUD.get_chat_room_by_id(room_id)
+        # Room details, members and statistics are independent queries
+        room, members, statistics = await fetch_if_member(
+            current_user["id"],
+            room_id,
+            asyncio.gather(
+                ChatCRUD.get_chat_room_by_id(room_id),
+                ChatCRUD.get_room_members_detailed(room_id),
+                ChatCRUD.get_room_statistics(room_id)
+            )
+        )
         if not room:
             raise HTTPException(status_code=404, detail="Chat room not found")
         
-        members = await ChatCRUD.get_room_members_detailed(room_id)
-        statistics = await ChatCRUD.get_room_statistics(room_id)
-        
         return {
             "room": room,
             "members": members,
@@ -358,77 +300,40 @@ async def get_room_messages(
     current_user: dict = Depends(get_current_active_user)
 ):
     """Get messages from a chat room"""
-    print(f"🔧 DEBUG: get_room_messages called for room_id={room_id}, user={current_user['username']}")
+    logger.debug("get_room_messages: room_id=%s user_id=%s", room_id, current_user["id"])
     try:
-        # Check if user is member of the room
-        print(f"🔧 DEBUG: Checking room membership...")
-        print(f"🔧 DEBUG: Checking membership for user_id={current_user['id']}, room_id={room_id}")
-        is_member = await ChatCRUD.is_user_in_room(current_user["id"], room_id)
-        print(f"🔧 DEBUG: Room membership check result: {is_member}")
-        
-        if not is_member:
-            print(f"🔧 DEBUG: Membership check failed - querying database directly...")
-            from db.database import supabase
-            debug_result = supabase.table("chat_room_members")\
-                .select("*")\
-                .eq("user_id", current_user["id"])\
-                .eq("room_id", room_id)\
-                .execute()
-            print(f"🔧 DEBUG: Direct query result: {debug_result.data}")
-            
-            # Also check all memberships for this user
-            all_memberships = supabase.table("chat_room_members")\
-                .select("*")\
-                .eq("user_id", current_user["id"])\
-                .execute()
-            print(f"🔧 DEBUG: All memberships for user: {all_memberships.data}")
-        
-        if not is_member:
-            print(f"🔧 DEBUG: ❌ User {current_user['username']} is not a member of room {room_id}")
-            raise HTTPException(status_code=403, detail="Not a member of this room")
-        
-        print(f"🔧 DEBUG: Fetching messages from CRUD...")
-        messages_data = await ChatCRUD.get_room_messages(room_id, limit, offset)
-        print(f"🔧 DEBUG: Retrieved {len(messages_data)} messages from database")
+        # Check membership while the messages are fetched
+        # The user's per-message status comes back embedded in the same query
+        messages_data = await fetch_if_member(
+            current_user["id"],
+            room_id,
+            ChatCRUD.get_room_messages(room_id, limit, offset, user_id=current_user["id"])
+        )
         
         messages = []
         for msg in messages_data:
-            # Get user's status for this message
-            status = await ChatCRUD.get_message_status(msg["id"], current_user["id"])
+            status = msg.get("my_status")
             
             # Convert reply_to if exists
             reply_to = None
             if msg.get("reply_to"):
                 reply = msg["reply_to"]
-                reply_to = MessageResponse(
+                reply_to = MessageResponse.model_construct(
                     id=reply["id"],
                     room_id=room_id,
                     sender_id=reply.get("sender_id", ""),
                     sender_username=reply.get("sender_username", "Unknown"),
-                    message_type=MessageType(reply["message_type"]),
+                    message_type=MESSAGE_TYPES[reply["message_type"]],
                     content=reply.get("content"),
-                    created_at=reply.get("created_at", datetime.utcnow()),
-                    updated_at=reply.get("updated_at", datetime.utcnow())
+                    created_at=to_datetime(reply.get("created_at", datetime.utcnow())),
+                    updated_at=to_datetime(reply.get("updated_at", datetime.utcnow()))
                 )
             
-            message = MessageResponse(
-                id=msg["id"],
-                room_id=msg["room_id"],
-                sender_id=msg["sender_id"],
-                sender_username=msg.get("sender_username", "Unknown"),
-                message_type=MessageType(msg["message_type"]),
-                content=msg.get("content"),
-                file_session_id=msg.get("file_session_id"),
-                file_path=msg.get("file_path"),
-                file_name=msg.get("file_name"),
-                file_size=msg.get("file_size"),
-                file_hash=msg.get("file_hash"),
+            messages.append(message_from_row(
+                msg,
                 reply_to=reply_to,
-                created_at=msg["created_at"],
-                updated_at=msg.get("updated_at", msg["created_at"]),
-                status=MessageStatus(status) if status else None
-            )
-            messages.append(message)
+                status=MESSAGE_STATUSES[status] if status else None
+            ))
         
         return MessagesResponse(
             messages=messages,
@@ -451,46 +356,41 @@ async def send_text_message(
     current_user: dict = Depends(get_current_active_user)
 ):
     """Send a text message to a chat room"""
-    print(f"🔧 DEBUG: send_text_message called with room_id={room_id}")
-    print(f"🔧 DEBUG: Request content: {request.content if hasattr(request, 'content') else 'No content'}")
-    print(f"🔧 DEBUG: Request reply_to_id: {request.reply_to_id if hasattr(request, 'reply_to_id') else 'No reply_to_id'}")
-    print(f"🔧 DEBUG: Current user: {current_user['username']} (ID: {current_user['id']})")
+    logger.debug("send_text_message: room_id=%s user_id=%s reply_to_id=%s",
+                 room_id, current_user["id"], request.reply_to_id)
     try:
         # Check if user is member of the room
-        is_member = await ChatCRUD.is_user_in_room(current_user["id"], room_id)
+        is_member = await is_user_in_room_cached(current_user["id"], room_id)
         if not is_member:
             raise HTTPException(status_code=403, detail="Not a member of this room")
         
-        # Send message via CRUD 
-        print(f"🔧 DEBUG: About to call ChatCRUD.send_text_message")
-        message = await ChatCRUD.send_text_message(
+        # Send message via CRUD, fetching the replied-to message alongside the insert
+        send = ChatCRUD.send_text_message(
             sender_id=current_user["id"],
             room_id=room_id,
             content=request.content,
             reply_to_id=request.reply_to_id
         )
-        print(f"🔧 DEBUG: Message sent successfully, ID: {message['id']}")
+        if request.reply_to_id:
+            message, reply_msg = await asyncio.gather(
+                send, ChatCRUD.get_message_by_id(request.reply_to_id)
+            )
+        else:
+            message, reply_msg = await send, None
+        logger.debug("Message %s stored in room %s", message["id"], room_id)
         
         # ✅ BROADCAST MESSAGE VIA WEBSOCKET TO ALL ROOM MEMBERS
-        print(f"🔧 DEBUG: Broadcasting message via WebSocket...")
         try:
             # Get reply context if exists
             reply_context = None
-            if request.reply_to_id:
-                reply_msg = await ChatCRUD.get_message_by_id(request.reply_to_id)
-                if reply_msg:
-                    reply_context = {
-                        "id": reply_msg["id"],
-                        "content": reply_msg["content"][:100] + ("..." if len(reply_msg["content"]) > 100 else ""),
-                        "sender_username": reply_msg.get("sender_username", "Unknown"),
-                        "message_type": reply_msg["message_type"]
-                    }
-
-            # Import the WebSocket manager and broadcast function
-            from routers.websocket import chat_manager
-            from models.chat import MessageType
-            from datetime import datetime
-            
+            if reply_msg:
+                reply_context = {
+                    "id": reply_msg["id"],
+                    "content": reply_preview(reply_msg.get("content") or ""),
+                    "sender_username": reply_msg.get("sender_username", "Unknown"),
+                    "message_type": reply_msg["message_type"]
+                }
+
             # Create broadcast message
             broadcast_message = {
                 "type": "new_message",
@@ -509,27 +409,19 @@ async def send_text_message(
             
             # Broadcast to all room members
             await chat_manager.broadcast_to_room(room_id, broadcast_message)
-            print(f"🔧 DEBUG: ✅ WebSocket broadcast successful")
             
             # Mark as delivered for all room members (except sender)
             member_ids = await ChatCRUD.get_room_member_ids(room_id)
-            for member_id in member_ids:
-                if member_id != current_user["id"]:  # Don't mark as delivered for sender
-                    await ChatCRUD.mark_message_status(message["id"], member_id, "delivered")
-            print(f"🔧 DEBUG: ✅ Message marked as delivered for room members")
+            await ChatCRUD.mark_message_status_bulk(
+                message["id"],
+                [member_id for member_id in member_ids if member_id != current_user["id"]],
+                MessageStatus.DELIVERED.value
+            )
             
         except Exception as ws_error:
-            print(f"🔧 DEBUG: ❌ WebSocket broadcast failed: {ws_error}")
+            logger.warning("WebSocket broadcast failed for message %s: %s", message["id"], ws_error)
             # Don't fail the API call if WebSocket fails
         
-        # Verify message was stored
-        print(f"🔧 DEBUG: Verifying message storage...")
-        verification = await ChatCRUD.get_message_by_id(message["id"])
-        if verification:
-            print(f"🔧 DEBUG: ✅ Message verification successful: {verification}")
-        else:
-            print(f"🔧 DEBUG: ❌ Message verification failed - message not found in DB")
-        
         return {"status": "sent", "message_id": message["id"]}
         
     except HTTPException:
@@ -547,7 +439,7 @@ async def mark_message_as_read(
     """Mark a message as read"""
     try:
         # Check if user is member of the room
-        is_member = await ChatCRUD.is_user_in_room(current_user["id"], room_id)
+        is_member = await is_user_in_room_cached(current_user["id"], room_id)
         if not is_member:
             raise HTTPException(status_code=403, detail="Not a member of this room")
         
@@ -574,7 +466,7 @@ async def mark_all_messages_as_read(
     """Mark all messages in a room as read"""
     try:
         # Check if user is member of the room
-        is_member = await ChatCRUD.is_user_in_room(current_user["id"], room_id)
+        is_member = await is_user_in_room_cached(current_user["id"], room_id)
         if not is_member:
             raise HTTPException(status_code=403, detail="Not a member of this room")
         
@@ -604,35 +496,34 @@ async def send_simple_file(
     """Send a small file directly to chat (not chunked)"""
     try:
         # Check if user is member of the room
-        is_member = await ChatCRUD.is_user_in_room(current_user["id"], room_id)
+        is_member = await is_user_in_room_cached(current_user["id"], room_id)
         if not is_member:
             raise HTTPException(status_code=403, detail="Not a member of this room")
         
         # File size limit for simple upload (10MB)
         MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
-        file_content = await file.read()
-        
-        if len(file_content) > MAX_FILE_SIZE:
-            raise HTTPException(
-                status_code=413, 
-                detail="File too large. Use chunked upload for files over 10MB."
-            )
-        
-        # Calculate file hash
-        from utils.hash_utils import compute_chunk_hash
-        file_hash = compute_chunk_hash(file_content)
-        
-        # Create chat files directory
-        chat_files_dir = "uploaded_files/chat"
-        os.makedirs(chat_files_dir, exist_ok=True)
-        
-        # Save file with unique name
-        file_extension = get_file_extension(file.filename)
-        unique_filename = f"{file_hash}{file_extension}"
-        file_path = os.path.join(chat_files_dir, unique_filename)
         
-        with open(file_path, "wb") as f:
-            f.write(file_content)
+        # Copy the spooled upload to a temp file and hash it in one pass, off the event loop
+        temp_path = os.path.join(CHAT_FILES_DIR, f".{secrets.token_hex(16)}.tmp")
+        try:
+            copied = await buffer_pool.run_in_thread(copy_upload_with_hash, file, temp_path, MAX_FILE_SIZE)
+            if copied is None:
+                raise HTTPException(
+                    status_code=413, 
+                    detail="File too large. Use chunked upload for files over 10MB."
+                )
+            file_hash, file_size = copied
+            
+            # Save file with unique name
+            file_extension = get_file_extension(file.filename)
+            unique_filename = f"{file_hash}{file_extension}"
+            file_path = os.path.join(CHAT_FILES_DIR, unique_filename)
+            # Identical content is already stored under the same name; the temp copy is dropped below
+            written = not await aiofiles.os.path.exists(file_path)
+            if written:
+                await aiofiles.os.replace(temp_path, file_path)
+        finally:
+            await asyncio.to_thread(delete_file_if_exists, temp_path)
         
         # Create file message
         message = await ChatCRUD.send_file_message(
@@ -641,15 +532,17 @@ async def send_simple_file(
             file_session_id=None,  # No session for simple upload
             file_path=file_path,
             file_name=file.filename,
-            file_size=len(file_content),
+            file_size=file_size,
             file_hash=file_hash,
-            reply_to_id=reply_to_id
+            reply_to_id=reply_to_id,
+            # Hashed as it was written; an existing copy is left for download to check
+            verified=written
         )
         
         return {
             "status": "sent",
             "message_id": message["id"],
-            "file_size": len(file_content),
+            "file_size": file_size,
             "file_hash": file_hash
         }
         
@@ -670,15 +563,12 @@ async def start_chat_file_upload(
     """Start chunked file upload for chat - uses existing upload system"""
     try:
         # Check room membership
-        is_member = await ChatCRUD.is_user_in_room(current_user["id"], room_id)
+        is_member = await is_user_in_room_cached(current_user["id"], room_id)
         if not is_member:
             raise HTTPException(status_code=403, detail="Not a member of this room")
         
-        # Use existing file session system
-        from db.crud import create_file_session
-        
         # Generate unique file ID for this upload session first
-        file_id = f"chat-{uuid.uuid4().hex[:8]}-{room_id}"
+        file_id = f"chat-{secrets.token_hex(4)}-{room_id}"
         
         file_session = await create_file_session(
             file_id,  # ✅ PROVIDE file_id AS FIRST ARGUMENT
@@ -690,6 +580,7 @@ async def start_chat_file_upload(
             upload_type="chat",  # ✅ MARK AS CHAT UPLOAD
             chat_room_id=room_id  # ✅ ASSOCIATE WITH CHAT ROOM
         )
+        remember_file_session(file_session)
         
         return FileUploadResponse(
             file_id=file_id,
@@ -712,30 +603,27 @@ async def upload_chat_file_chunk(
     total_chunks: int = Form(...),
     chunk: UploadFile = File(...),
     chunk_hash: str = Form(...),
+    chunk_hash_algorithm: str = Form(default="sha256"),
     current_user: dict = Depends(get_current_active_user)
 ):
     """Upload file chunk for chat - REUSES existing chunk upload logic"""
     try:
         # Verify room membership
-        is_member = await ChatCRUD.is_user_in_room(current_user["id"], room_id)
+        is_member = await is_user_in_room_cached(current_user["id"], room_id)
         if not is_member:
             raise HTTPException(status_code=403, detail="Not a member of this room")
         
         # Use existing chunk upload logic
-        from routers.upload import process_chunk_upload
-        
-        chunk_data = await chunk.read()
         try:
             result = await process_chunk_upload(
                 file_id=file_id,
                 chunk_number=chunk_number,
-                chunk_data=chunk_data,
+                chunk=chunk,
                 chunk_hash=chunk_hash,
-                user_id=current_user["id"]
+                user_id=current_user["id"],
+                chunk_hash_algorithm=chunk_hash_algorithm
             )
             
-            print(f"DEBUG: Chat router - result type: {type(result)}, value: {result}")
-            
             # ✅ NOTIFY CHAT ROOM VIA WEBSOCKET
             progress_data = {
                 "progress": result.get("progress", 0),
@@ -743,14 +631,16 @@ async def upload_chat_file_chunk(
                 "total_chunks": total_chunks,
                 "file_name": result.get("filename", "")
             }
-        except Exception as e:
-            print(f"DEBUG: Chat router - Exception in process_chunk_upload: {type(e).__name__}: {e}")
-            print(f"DEBUG: Exception details - status_code: {getattr(e, 'status_code', 'N/A')}, detail: {getattr(e, 'detail', 'N/A')}")
-            import traceback
-            print(f"DEBUG: Full traceback: {traceback.format_exc()}")
+        except Exception:
+            logger.debug("process_chunk_upload failed for %s chunk %s", file_id, chunk_number, exc_info=True)
             raise
         
-        await notify_chat_file_progress(room_id, file_id, current_user["id"], progress_data)
+        # Coalesced per room and file, like the upload progress frames
+        progress_coalescer.update(
+            (room_id, file_id),
+            partial(notify_chat_file_progress, room_id, file_id, current_user["id"]),
+            progress_data
+        )
         
         return result
         
@@ -770,32 +660,21 @@ async def complete_chat_file_upload(
 ):
     """Complete chunked file upload and create chat message"""
     try:
-        print(f"DEBUG: complete_chat_file_upload called with file_id={file_id}, room_id={room_id}")
+        logger.debug("complete_chat_file_upload: file_id=%s room_id=%s", file_id, room_id)
         
         # Verify room membership
-        is_member = await ChatCRUD.is_user_in_room(current_user["id"], room_id)
+        is_member = await is_user_in_room_cached(current_user["id"], room_id)
         if not is_member:
-            print(f"DEBUG: User {current_user['id']} not a member of room {room_id}")
             raise HTTPException(status_code=403, detail="Not a member of this room")
         
-        print(f"DEBUG: Room membership verified")
-        
         # Use existing complete upload logic
-        from routers.upload import complete_file_upload
-        
-        print(f"DEBUG: About to call complete_file_upload")
         completed_file = await complete_file_upload(
             file_id=file_id,
             expected_hash=expected_hash,
             user_id=current_user["id"]
         )
-        print(f"DEBUG: complete_file_upload returned: {completed_file}")
         
         # Create chat message with the completed file
-        print(f"DEBUG: About to call send_file_message")
-        print(f"DEBUG: completed_file data: {completed_file}")
-        print(f"DEBUG: file_session_id: {completed_file['session_id']} (type: {type(completed_file['session_id'])})")
-        
         try:
             message = await ChatCRUD.send_file_message(
                 sender_id=current_user["id"],
@@ -805,22 +684,21 @@ async def complete_chat_file_upload(
                 file_name=completed_file["original_filename"],
                 file_size=completed_file["file_size"],
                 file_hash=completed_file["file_hash"],
-                reply_to_id=reply_to_id
+                reply_to_id=reply_to_id,
+                verified=True,  # The merge hashed the file as it wrote it
+                # Large files get a tree hash so downloads can verify them on all cores
+                tree_hash=completed_file["tree_hash"]
             )
-            print(f"DEBUG: send_file_message returned: {message}")
-        except Exception as e:
-            print(f"ERROR: Exception in send_file_message: {type(e).__name__}: {e}")
-            import traceback
-            print(f"ERROR: Full traceback: {traceback.format_exc()}")
+        except Exception:
+            logger.exception("send_file_message failed for file session %s", completed_file["session_id"])
             raise
         
         # ✅ NOTIFY CHAT ROOM VIA WEBSOCKET
         try:
-            print(f"DEBUG: About to call notify_chat_file_complete")
+            await progress_coalescer.flush((room_id, file_id))
             await notify_chat_file_complete(room_id, message)
-            print(f"DEBUG: WebSocket notification sent successfully")
         except Exception as ws_error:
-            print(f"ERROR: WebSocket notification failed: {type(ws_error).__name__}: {ws_error}")
+            logger.warning("WebSocket file notification failed: %s: %s", type(ws_error).__name__, ws_error)
             # Continue even if WebSocket fails
         
         result = {
@@ -828,14 +706,12 @@ async def complete_chat_file_upload(
             "file_info": completed_file,
             "status": "completed"
         }
-        print(f"DEBUG: Returning result: {result}")
         return result
         
-    except HTTPException as he:
-        print(f"DEBUG: HTTPException in complete_chat_file_upload: {he.status_code} - {he.detail}")
-        raise he
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"DEBUG: Exception in complete_chat_file_upload: {type(e).__name__}: {e}")
+        logger.debug("complete_chat_file_upload failed: %s: %s", type(e).__name__, e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
@@ -844,9 +720,11 @@ async def complete_chat_file_upload(
 @router.get("/files/{message_id}/download")
 async def download_chat_file(
     message_id: str,
+    request: Request,
+    verify: bool = False,
     current_user: dict = Depends(get_current_active_user)
 ):
-    """Download a file from chat message"""
+    """Download a file from chat message (verify=true forces an integrity check)"""
     try:
         # Get message and verify access
         message = await ChatCRUD.get_message_by_id(message_id)
@@ -854,7 +732,7 @@ async def download_chat_file(
             raise HTTPException(status_code=404, detail="Message not found")
         
         # Check if user has access to this room
-        is_member = await ChatCRUD.is_user_in_room(current_user["id"], message["room_id"])
+        is_member = await is_user_in_room_cached(current_user["id"], message["room_id"])
         if not is_member:
             raise HTTPException(status_code=403, detail="Access denied")
         
@@ -862,22 +740,30 @@ async def download_chat_file(
         if message["message_type"] not in ["file", "image"]:
             raise HTTPException(status_code=400, detail="Message does not contain a file")
         
+        # The content hash is a strong ETag; a client holding this file needs no body
+        cache_headers = {
+            "ETag": f'"{message["file_hash"]}"',
+            "Cache-Control": "private, max-age=3600"
+        }
+        if_none_match = request.headers.get("if-none-match", "")
+        if not verify and cache_headers["ETag"] in (tag.strip() for tag in if_none_match.split(",")):
+            return Response(status_code=304, headers=cache_headers)
+        
         file_path = message["file_path"]
-        if not os.path.exists(file_path):
+        # Stat once here and hand it to the response, which would otherwise stat again
+        try:
+            file_stat = await aiofiles.os.stat(file_path)
+        except FileNotFoundError:
             raise HTTPException(status_code=404, detail="File not found on server")
         
-        # ✅ USE EXISTING HASH VERIFICATION
-        from utils.hash_utils import verify_file_integrity
+        # ✅ USE EXISTING HASH VERIFICATION (only when the last check is stale)
+        if verify or not recently_verified(message.get("verified_at")):
+            if not await cached_verify(file_path, message["file_hash"], file_stat, message.get("tree_hash")):
+                raise HTTPException(status_code=500, detail="File integrity check failed")
+            
+            await ChatCRUD.mark_file_verified(message_id)
         
-        if not await verify_file_integrity(file_path, message["file_hash"]):
-            raise HTTPException(status_code=500, detail="File integrity check failed")
-        
-        from fastapi.responses import FileResponse
-        return FileResponse(
-            path=file_path,
-            media_type='application/octet-stream',
-            filename=message["file_name"]
-        )
+        return file_download_response(file_path, message["file_name"], file_stat, cache_headers)
         
     except HTTPException:
         raise
@@ -896,7 +782,7 @@ async def add_user_to_room(
     """Add a user to an existing chat room (admin only)"""
     try:
         # Check if current user is admin of the room
-        user_role = await ChatCRUD.get_user_role_in_room(current_user["id"], room_id)
+        user_role = await get_user_role_cached(current_user["id"], room_id)
         if user_role != "admin":
             raise HTTPException(status_code=403, detail="Only room admins can add members")
         
@@ -909,6 +795,7 @@ async def add_user_to_room(
         success = await ChatCRUD.add_single_room_member(room_id, user_id, "member")
         
         if success:
+            remember_membership((user_id,), room_id)
             return {"status": "success", "message": f"User {target_user['username']} added to room"}
         else:
             raise HTTPException(status_code=400, detail="Failed to add user to room")
@@ -926,12 +813,9 @@ async def get_room_files(
 ):
     """Get all files shared in a chat room"""
     try:
-        # Check if user is member of the room
-        is_member = await ChatCRUD.is_user_in_room(current_user["id"], room_id)
-        if not is_member:
-            raise HTTPException(status_code=403, detail="Not a member of this room")
-        
-        files = await ChatCRUD.get_chat_files_for_room(room_id, limit)
+        files = await fetch_if_member(
+            current_user["id"], room_id, ChatCRUD.get_chat_files_for_room(room_id, limit)
+        )
         
         return {
             "files": files,
@@ -952,17 +836,18 @@ async def search_room_messages(
     limit: int = 20,
     current_user: dict = Depends(get_current_active_user)
 ):
-    """Search messages in a chat room"""
+    """
+    Search messages in a chat room. Words match by English stem and prefix
+    ("upload" finds "uploading", but "port" does not find "export"); a query made
+    only of stopwords like "the" is matched as a plain substring instead.
+    """
     try:
-        # Check if user is member of the room
-        is_member = await ChatCRUD.is_user_in_room(current_user["id"], room_id)
-        if not is_member:
-            raise HTTPException(status_code=403, detail="Not a member of this room")
-        
         if len(q.strip()) < 2:
             raise HTTPException(status_code=400, detail="Search query must be at least 2 characters")
         
-        messages = await ChatCRUD.search_messages(room_id, q, limit)
+        messages = await fetch_if_member(
+            current_user["id"], room_id, ChatCRUD.search_messages(room_id, q, limit)
+        )
         
         return {
             "messages": messages,
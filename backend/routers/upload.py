@@ -1,39 +1,38 @@
 from fastapi import APIRouter, Form, File, UploadFile, HTTPException, BackgroundTasks, Depends, status
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.responses import JSONResponse, ORJSONResponse, StreamingResponse
 import asyncio
-from typing import Dict, List, Any
+import logging
+from functools import partial
+from typing import Dict, List, Any, Tuple
 import time
 import os
+import aiofiles.os
+import orjson
 
 from services.chunk_service import chunk_service
+from services.chunk_recorder import chunk_recorder
 from services.network_monitor import network_monitor
+from services.ws_coalescer import progress_coalescer
+from routers.websocket import upload_manager
 from db.crud import (
-    create_file_session, get_file_session, mark_chunk_uploaded, 
-    get_uploaded_chunk_numbers, update_upload_progress
+    create_file_session, get_file_session, update_upload_progress
 )
 from db.auth_crud import get_user_file_sessions, verify_file_ownership
 from dependencies.auth import get_current_active_user as get_current_user
 from config import settings
+from utils.download import file_download_response
+from utils.hash_cache import remember_file_hash
+from utils.session_cache import get_file_session_cached, forget_file_session, remember_file_session
+from utils.hash_utils import supported_chunk_hash_algorithms
 
 # Import WebSocket managers after router is created to avoid circular imports
 router = APIRouter(prefix="/upload", tags=["upload"])
+logger = logging.getLogger(__name__)
 
-# WebSocket managers will be imported dynamically to avoid circular imports
-async def get_upload_websocket_manager():
-    """Dynamically import upload WebSocket manager to avoid circular imports"""
-    try:
-        from routers.websocket import upload_manager
-        return upload_manager
-    except ImportError:
-        return None
-
-async def get_chat_websocket_manager():
-    """Dynamically import chat WebSocket manager to avoid circular imports"""
-    try:
-        from routers.websocket import chat_manager
-        return chat_manager
-    except ImportError:
-        return None
+# Comment line sent on an idle event stream so proxies keep it open
+STATUS_STREAM_KEEPALIVE_SECONDS = 15
+# Frames after which an upload's event stream ends
+STATUS_STREAM_FINAL_TYPES = {"completed", "error"}
 
 @router.post("/start")
 async def start_upload(
@@ -57,25 +56,31 @@ async def start_upload(
             user_id=current_user["id"],
             upload_type="regular"  # ✅ PRESERVE EXISTING BEHAVIOR
         )
+        # The first chunk then acknowledges without a database round-trip
+        remember_file_session(session)
         
         # Get optimal chunk size for this upload
         optimal_chunk_size = network_monitor.get_optimal_chunk_size()
         
         # Send WebSocket update
-        manager = await get_websocket_manager()
-        if manager:
-            await manager.send_progress_update(file_id, {
-                "type": "upload_started",
-                "filename": filename,
-                "total_chunks": total_chunks,
-                "file_size": file_size,
-                "recommended_chunk_size": optimal_chunk_size
-            })
+        await upload_manager.send_progress_update(file_id, {
+            "type": "upload_started",
+            "filename": filename,
+            "total_chunks": total_chunks,
+            "file_size": file_size,
+            "recommended_chunk_size": optimal_chunk_size
+        })
         
         return JSONResponse({
             "status": "started",
             "file_id": file_id,
             "chunk_size": optimal_chunk_size,
+            # Chunks may be sent concurrently and in any order, up to this many in flight;
+            # re-sending a chunk is idempotent
+            "max_in_flight_chunks": settings.CONCURRENT_UPLOADS,
+            # Clients may send up to max_batch_chunks chunks per request here
+            "batch_endpoint": "/upload/chunks/batch",
+            "max_batch_chunks": settings.MAX_BATCH_CHUNKS,
             "message": "Upload session created",
             "user_id": current_user["id"]  # ✅ RETURN USER INFO
         })
@@ -89,6 +94,7 @@ async def upload_chunk(
     chunk_number: int = Form(...),
     total_chunks: int = Form(...),
     chunk_hash: str = Form(...),
+    chunk_hash_algorithm: str = Form(default="sha256"),
     attempt: int = Form(default=1),
     chunk: UploadFile = File(...),
     current_user: dict = Depends(get_current_user)  # ✅ REQUIRE AUTH
@@ -99,16 +105,15 @@ async def upload_chunk(
         if chunk.size == 0:
             raise HTTPException(status_code=400, detail="Empty chunk received")
         
-        # Read chunk data
-        chunk_data = await chunk.read()
-        
         # ✅ USE SHARED HELPER FUNCTION (WORKS FOR BOTH REGULAR AND CHAT)
+        # The chunk is streamed from its spooled file, never read whole into memory
         result = await process_chunk_upload(
             file_id=file_id,
             chunk_number=chunk_number,
-            chunk_data=chunk_data,
+            chunk=chunk,
             chunk_hash=chunk_hash,
-            user_id=current_user["id"]
+            user_id=current_user["id"],
+            chunk_hash_algorithm=chunk_hash_algorithm
         )
         
         # ✅ PRESERVE EXISTING RESPONSE FORMAT
@@ -126,17 +131,15 @@ async def upload_chunk(
         raise
     except Exception as e:
         # Record failure and provide retry guidance
-        network_monitor.record_upload(len(chunk_data) if 'chunk_data' in locals() else 0, upload_time, False)
+        network_monitor.record_upload(chunk.size or 0, 0, False)
         
         # Send WebSocket error
-        manager = await get_websocket_manager()
-        if manager:
-            await manager.send_progress_update(file_id, {
-                "type": "chunk_failed", 
-                "chunk_number": chunk_number,
-                "error": str(e),
-                "retry_recommended": True
-            })
+        await upload_manager.send_progress_update(file_id, {
+            "type": "chunk_failed", 
+            "chunk_number": chunk_number,
+            "error": str(e),
+            "retry_recommended": True
+        })
         
         # Suggest retry with smaller chunk size if this was a large chunk
         retry_chunk_size = network_monitor.get_optimal_chunk_size()
@@ -151,6 +154,59 @@ async def upload_chunk(
             }
         )
 
+@router.post("/chunks/batch")
+async def upload_chunk_batch(
+    file_id: str = Form(...),
+    manifest: str = Form(...),
+    chunk_hash_algorithm: str = Form(default="sha256"),
+    chunks: List[UploadFile] = File(...),
+    current_user: dict = Depends(get_current_user)  # ✅ REQUIRE AUTH
+):
+    """Upload several chunks in one request; manifest is a JSON list of {chunk_number, chunk_hash} in chunk order"""
+    try:
+        entries = orjson.loads(manifest)
+        if not isinstance(entries, list) or len(entries) != len(chunks):
+            raise HTTPException(status_code=400, detail="Manifest must list one entry per chunk")
+        if len(chunks) > settings.MAX_BATCH_CHUNKS:
+            raise HTTPException(status_code=400, detail=f"At most {settings.MAX_BATCH_CHUNKS} chunks per batch")
+        batch = [
+            (int(entry["chunk_number"]), chunk, str(entry["chunk_hash"]))
+            for entry, chunk in zip(entries, chunks)
+        ]
+    except HTTPException:
+        raise
+    except (orjson.JSONDecodeError, KeyError, TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid chunk manifest")
+    
+    if any(chunk.size == 0 for _, chunk, _ in batch):
+        raise HTTPException(status_code=400, detail="Empty chunk received")
+    
+    result = await process_chunk_batch(
+        file_id=file_id,
+        batch=batch,
+        user_id=current_user["id"],
+        chunk_hash_algorithm=chunk_hash_algorithm
+    )
+    
+    # Failed chunks are reported individually so the client retries only those
+    for failure in result["failed_chunks"]:
+        await upload_manager.send_progress_update(file_id, {
+            "type": "chunk_failed",
+            "chunk_number": failure["chunk_number"],
+            "error": failure["error"],
+            "retry_recommended": True
+        })
+    
+    return JSONResponse({
+        "status": "success" if not result["failed_chunks"] else "partial",
+        "saved_chunks": result["saved_chunks"],
+        "failed_chunks": result["failed_chunks"],
+        "uploaded_chunks": result["uploaded_chunks"],
+        "total_chunks": result["total_chunks"],
+        "progress": result["progress"],
+        "recommended_chunk_size": network_monitor.get_optimal_chunk_size()
+    })
+
 @router.get("/status/{file_id}")
 async def get_upload_status(
     file_id: str,
@@ -159,7 +215,7 @@ async def get_upload_status(
     """Get current upload status and missing chunks"""
     try:
         # Get session info
-        session = get_file_session(file_id)
+        session = await asyncio.to_thread(get_file_session, file_id)
         if not session:
             raise HTTPException(status_code=404, detail="Upload session not found")
         
@@ -168,18 +224,19 @@ async def get_upload_status(
             raise HTTPException(status_code=403, detail="Unauthorized access to upload session")
         
         # Get uploaded chunks
-        uploaded_chunks = await chunk_service.get_uploaded_chunks(file_id)
+        # From memory while this process is receiving the upload; no directory scan per poll
+        known_chunks = await chunk_service.known_uploaded_chunks(file_id)
         total_chunks = session.get('total_chunks', 0)
         
-        # Calculate missing chunks
-        expected_chunks = set(range(total_chunks))
-        missing_chunks = sorted(expected_chunks - set(uploaded_chunks))
+        # Uploaded and missing chunks from one bitmap pass
+        uploaded_chunks, missing_chunks = chunk_service.split_chunks(known_chunks, total_chunks)
         
         # Get network recommendations
         optimal_chunk_size = network_monitor.get_optimal_chunk_size()
         use_concurrent = network_monitor.should_use_concurrent_upload()
         
-        return JSONResponse({
+        # Both chunk lists can hold ~total_chunks ints; orjson serializes them in C
+        return ORJSONResponse({
             "file_id": file_id,
             "uploaded_chunks": uploaded_chunks,
             "missing_chunks": missing_chunks,
@@ -196,6 +253,47 @@ async def get_upload_status(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get status: {str(e)}")
 
+@router.get("/status/stream/{file_id}")
+async def stream_upload_status(
+    file_id: str,
+    current_user: dict = Depends(get_current_user)  # ✅ REQUIRE AUTH
+):
+    """Stream upload progress as Server-Sent Events, instead of polling /status"""
+    session = await get_file_session_cached(file_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    
+    # ✅ VERIFY USER OWNS THIS UPLOAD SESSION
+    if session.get("user_id") != current_user["id"]:
+        raise HTTPException(status_code=403, detail="Unauthorized access to upload session")
+    
+    user_info = {"id": current_user["id"], "email": current_user.get("email", "unknown")}
+    return StreamingResponse(
+        status_events(file_id, user_info),
+        media_type="text/event-stream",
+        # X-Accel-Buffering stops nginx from holding events back
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def status_events(file_id: str, user_info: dict):
+    """Yield the upload WebSocket's frames for file_id as SSE events"""
+    # Registered like a WebSocket watcher, so it gets the same coalesced broadcasts
+    subscriber = upload_manager.subscribe(file_id, user_info)
+    try:
+        yield f"data: {orjson.dumps({'type': 'connected', 'file_id': file_id}).decode()}\n\n"
+        while True:
+            try:
+                message = await asyncio.wait_for(subscriber.queue.get(), timeout=STATUS_STREAM_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            yield f"data: {message}\n\n"
+            if orjson.loads(message).get("type") in STATUS_STREAM_FINAL_TYPES:
+                break
+    finally:
+        # Runs on client disconnect too, when the response task is cancelled
+        upload_manager.disconnect(subscriber, file_id)
+
 @router.post("/complete")
 async def complete_upload(
     background_tasks: BackgroundTasks,
@@ -227,9 +325,7 @@ async def complete_upload(
         
     except Exception as e:
         # Send WebSocket error
-        manager = await get_websocket_manager()
-        if manager:
-            await manager.send_error(file_id, f"Failed to complete upload: {str(e)}")
+        await upload_manager.send_error(file_id, f"Failed to complete upload: {str(e)}")
         
         # Update session status to failed
         try:
@@ -256,6 +352,9 @@ async def cancel_upload(
             if session.get("user_id") != current_user["id"]:
                 raise HTTPException(status_code=403, detail="Unauthorized access to upload session")
             
+            # Queued chunk rows would otherwise land after the cancellation
+            await chunk_recorder.discard(file_id)
+            forget_file_session(file_id)
             await update_upload_progress(file_id, 0, session['total_chunks'], status="cancelled")
         
         # Schedule cleanup
@@ -351,91 +450,86 @@ async def download_file(
     current_user: dict = Depends(get_current_user)  # ✅ REQUIRE AUTH
 ):
     """Download an uploaded file"""
-    from fastapi.responses import FileResponse
-    import os
-    
     # Handle both just filename or full path with filename
     if '/' in filename:
         filename = os.path.basename(filename)
     
     file_path = settings.UPLOAD_DIR / filename
     
-    if not file_path.exists():
+    try:
+        file_stat = await aiofiles.os.stat(file_path)
+    except FileNotFoundError:
         raise HTTPException(status_code=404, detail=f"File '{filename}' not found in uploaded_files directory")
     
     # ✅ TODO: ADD FILE OWNERSHIP VERIFICATION
     # For now allowing all authenticated users to download files
     # In production, you might want to track file ownership in database
     
-    return FileResponse(
-        path=str(file_path),
-        filename=filename,
-        media_type='application/octet-stream'
-    )
+    return file_download_response(str(file_path), filename, file_stat)
 
 
 # ✅ HELPER FUNCTIONS FOR CHAT INTEGRATION (PRESERVES ALL EXISTING FUNCTIONALITY)
 
-async def process_chunk_upload(file_id: str, chunk_number: int, chunk_data: bytes, 
-                             chunk_hash: str, user_id: str) -> Dict[str, Any]:
+async def process_chunk_upload(file_id: str, chunk_number: int, chunk: UploadFile, 
+                             chunk_hash: str, user_id: str,
+                             chunk_hash_algorithm: str = "sha256") -> Dict[str, Any]:
     """Process chunk upload for both regular and chat uploads"""
     try:
-        print(f"DEBUG: process_chunk_upload called with file_id={file_id}, chunk_number={chunk_number}, user_id={user_id}")
+        # Chunk hashes only guard transport integrity, so a faster non-SHA-256
+        # algorithm may be negotiated; the final file hash is always SHA-256
+        if chunk_hash_algorithm not in supported_chunk_hash_algorithms():
+            raise HTTPException(status_code=400, detail=f"Unsupported chunk hash algorithm: {chunk_hash_algorithm}")
         
-        # Get the file session
-        session = get_file_session(file_id)
+        logger.debug("process_chunk_upload called with file_id=%s, chunk_number=%s, user_id=%s", file_id, chunk_number, user_id)
+        
+        # Get the file session (cached; only its fixed fields are used here)
+        session = await get_file_session_cached(file_id)
         if not session:
-            print(f"DEBUG: File session {file_id} not found")
+            logger.debug("File session %s not found", file_id)
             raise HTTPException(status_code=404, detail=f"File session {file_id} not found")
         
-        print(f"DEBUG: File session found: {session}")
-        
         # Verify ownership (works for both regular and chat uploads)
         if session.get("user_id") != user_id:
-            print(f"DEBUG: Ownership check failed - session user_id: {session.get('user_id')}, request user_id: {user_id}")
+            logger.debug("Ownership check failed - session user_id: %s, request user_id: %s", session.get('user_id'), user_id)
             raise HTTPException(status_code=403, detail="Not authorized to upload to this session")
         
         # Use existing chunk service
-        print(f"DEBUG: About to call save_chunk_with_verification")
-        success = await chunk_service.save_chunk_with_verification(
+        success = await chunk_service.save_chunk_streaming(
             file_id=file_id,
             chunk_number=chunk_number,
-            chunk_data=chunk_data,
-            expected_hash=chunk_hash
+            chunk=chunk,
+            expected_hash=chunk_hash,
+            hash_algorithm=chunk_hash_algorithm
         )
-        print(f"DEBUG: save_chunk_with_verification returned: {success}")
+        logger.debug("save_chunk_streaming returned: %s", success)
         
         if not success:
-            print(f"DEBUG: Chunk upload failed, raising HTTPException")
+            logger.debug("Chunk upload failed, raising HTTPException")
             raise HTTPException(status_code=400, detail="Chunk upload failed")
         
-        # Mark chunk as uploaded
-        print(f"DEBUG: About to mark chunk as uploaded")
-        await mark_chunk_uploaded(file_id, chunk_number)
-        print(f"DEBUG: Chunk marked as uploaded")
+        # Mark chunk as uploaded and update progress, written behind in one batch per interval
+        chunk_recorder.record(file_id, (chunk_number,), session["total_chunks"])
         
-        # Update progress
-        print(f"DEBUG: About to get uploaded chunk numbers")
-        uploaded_chunks = len(get_uploaded_chunk_numbers(file_id))
-        print(f"DEBUG: Got uploaded chunk numbers, count: {uploaded_chunks}")
+        # Counted in memory; re-reading every chunk row made each chunk O(chunks so far)
+        uploaded_chunks = chunk_service.uploaded_chunk_count(file_id)
         progress = (uploaded_chunks / session["total_chunks"]) * 100
-        print(f"DEBUG: Calculated progress: {progress}")
-        
-        print(f"DEBUG: About to update upload progress")
-        await update_upload_progress(file_id, uploaded_chunks, session["total_chunks"])
-        print(f"DEBUG: Upload progress updated")
         
         # ✅ NOTIFY WEBSOCKET (WORKS FOR BOTH REGULAR AND CHAT)
-        websocket_manager = await get_upload_websocket_manager()
-        if websocket_manager:
-            await websocket_manager.send_progress_update(file_id, {
-                "type": "chunk_uploaded",
-                "file_id": file_id,
-                "chunk_number": chunk_number,
-                "progress": progress,
-                "uploaded_chunks": uploaded_chunks,
-                "total_chunks": session["total_chunks"]
-            })
+        # Coalesced so a burst of chunks sends at most one frame per interval;
+        # skipped outright when nobody is watching this upload
+        if upload_manager.has_watchers(file_id):
+            progress_coalescer.update(
+                file_id,
+                partial(upload_manager.send_progress_update, file_id),
+                {
+                    "type": "chunk_uploaded",
+                    "file_id": file_id,
+                    "chunk_number": chunk_number,
+                    "progress": progress,
+                    "uploaded_chunks": uploaded_chunks,
+                    "total_chunks": session["total_chunks"]
+                }
+            )
         
         result = {
             "status": "chunk_uploaded",
@@ -445,16 +539,13 @@ async def process_chunk_upload(file_id: str, chunk_number: int, chunk_data: byte
             "total_chunks": session["total_chunks"],
             "filename": session.get("filename", "")
         }
-        print(f"DEBUG: Returning result: {result}")
         return result
     
     except HTTPException as he:
-        print(f"DEBUG: HTTPException in process_chunk_upload: status={he.status_code}, detail={he.detail}")
+        logger.debug("HTTPException in process_chunk_upload: status=%s, detail=%s", he.status_code, he.detail)
         raise he
     except Exception as e:
-        print(f"DEBUG: Unexpected exception in process_chunk_upload: {type(e).__name__}: {e}")
-        import traceback
-        print(f"DEBUG: Full traceback: {traceback.format_exc()}")
+        logger.exception("Unexpected exception in process_chunk_upload")
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
         
     except HTTPException:
@@ -462,46 +553,115 @@ async def process_chunk_upload(file_id: str, chunk_number: int, chunk_data: byte
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Chunk upload failed: {str(e)}")
 
+async def process_chunk_batch(file_id: str, batch: List[Tuple[int, UploadFile, str]], user_id: str,
+                              chunk_hash_algorithm: str = "sha256") -> Dict[str, Any]:
+    """Save a batch of (chunk_number, chunk, chunk_hash) with one session check and one progress update"""
+    if chunk_hash_algorithm not in supported_chunk_hash_algorithms():
+        raise HTTPException(status_code=400, detail=f"Unsupported chunk hash algorithm: {chunk_hash_algorithm}")
+    
+    session = await get_file_session_cached(file_id)
+    if not session:
+        raise HTTPException(status_code=404, detail=f"File session {file_id} not found")
+    if session.get("user_id") != user_id:
+        raise HTTPException(status_code=403, detail="Not authorized to upload to this session")
+    
+    outcomes = await asyncio.gather(
+        *(
+            chunk_service.save_chunk_streaming(
+                file_id=file_id,
+                chunk_number=chunk_number,
+                chunk=chunk,
+                expected_hash=chunk_hash,
+                hash_algorithm=chunk_hash_algorithm
+            )
+            for chunk_number, chunk, chunk_hash in batch
+        ),
+        return_exceptions=True
+    )
+    
+    saved_chunks = []
+    failed_chunks = []
+    for (chunk_number, chunk, _), outcome in zip(batch, outcomes):
+        if outcome is True:
+            saved_chunks.append(chunk_number)
+        else:
+            error = outcome.detail if isinstance(outcome, HTTPException) else str(outcome) or "Chunk upload failed"
+            network_monitor.record_upload(chunk.size or 0, 0, False)
+            failed_chunks.append({"chunk_number": chunk_number, "error": error})
+    
+    uploaded_chunks = chunk_service.uploaded_chunk_count(file_id)
+    progress = (uploaded_chunks / session["total_chunks"]) * 100
+    
+    if saved_chunks:
+        chunk_recorder.record(file_id, saved_chunks, session["total_chunks"])
+        
+        if upload_manager.has_watchers(file_id):
+            progress_coalescer.update(
+                file_id,
+                partial(upload_manager.send_progress_update, file_id),
+                {
+                    "type": "chunk_uploaded",
+                    "file_id": file_id,
+                    "chunk_number": saved_chunks[-1],
+                    "progress": progress,
+                    "uploaded_chunks": uploaded_chunks,
+                    "total_chunks": session["total_chunks"]
+                }
+            )
+    
+    return {
+        "saved_chunks": saved_chunks,
+        "failed_chunks": failed_chunks,
+        "progress": progress,
+        "uploaded_chunks": uploaded_chunks,
+        "total_chunks": session["total_chunks"]
+    }
+
 
 async def complete_file_upload(file_id: str, expected_hash: str, user_id: str) -> Dict[str, Any]:
     """Complete file upload for both regular and chat uploads"""
     try:
-        print(f"DEBUG: complete_file_upload called with file_id={file_id}, user_id={user_id}")
+        logger.debug("complete_file_upload called with file_id=%s, user_id=%s", file_id, user_id)
         
         # Get the file session
         session = get_file_session(file_id)
         if not session:
-            print(f"DEBUG: File session {file_id} not found")
+            logger.debug("File session %s not found", file_id)
             raise HTTPException(status_code=404, detail=f"File session {file_id} not found")
         
-        print(f"DEBUG: File session found: {session}")
+        logger.debug("File session found: %s", session)
         
         # Verify ownership
         if session.get("user_id") != user_id:
-            print(f"DEBUG: Ownership check failed - session user_id: {session.get('user_id')}, request user_id: {user_id}")
+            logger.debug("Ownership check failed - session user_id: %s, request user_id: %s", session.get('user_id'), user_id)
             raise HTTPException(status_code=403, detail="Not authorized to complete this upload")
         
+        # Persist chunk rows still queued behind the last chunk responses
+        await chunk_recorder.flush(file_id)
+        forget_file_session(file_id)
+        
         # Use existing chunk service to merge chunks
-        print(f"DEBUG: About to call merge_chunks_with_verification")
-        combined_file_path, computed_hash = await chunk_service.merge_chunks_with_verification(
+        combined_file_path, computed_hash, tree_hash = await chunk_service.merge_chunks_with_verification(
             file_id=file_id,
             total_chunks=session["total_chunks"],
             expected_file_hash=expected_hash,
             filename=session["filename"]
         )
-        print(f"DEBUG: merge_chunks_with_verification returned: {combined_file_path}, hash: {computed_hash}")
+        logger.debug("merge_chunks_with_verification returned: %s, hash: %s", combined_file_path, computed_hash)
         
         if not combined_file_path:
-            print(f"DEBUG: merge_chunks_with_verification failed, raising HTTPException")
+            logger.debug("merge_chunks_with_verification failed, raising HTTPException")
             raise HTTPException(status_code=400, detail="Failed to combine chunks")
         
         # ✅ NOTIFY WEBSOCKET COMPLETION
-        websocket_manager = await get_upload_websocket_manager()
-        if websocket_manager:
-            await websocket_manager.send_completion(file_id, str(combined_file_path))
+        # Deliver the last progress frame before the completion message
+        await progress_coalescer.flush(file_id)
+        await upload_manager.send_completion(file_id, str(combined_file_path))
         
         # Return comprehensive file info
         file_stats = os.stat(combined_file_path)
+        # The merge just hashed this file; later downloads can reuse the result
+        remember_file_hash(str(combined_file_path), file_stats, computed_hash)
         
         return {
             "status": "completed",
@@ -511,6 +671,8 @@ async def complete_file_upload(file_id: str, expected_hash: str, user_id: str) -
             "original_filename": session["filename"],
             "file_size": file_stats.st_size,
             "file_hash": expected_hash,
+            # Computed by the merge for large files; None otherwise
+            "tree_hash": tree_hash,
             "total_chunks": session["total_chunks"]
         }
         
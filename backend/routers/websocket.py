@@ -1,14 +1,46 @@
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, HTTPException, Query
 from typing import Dict, Set, Optional, List
-import json
 import asyncio
+import orjson
+import traceback
 from datetime import datetime
 from services.auth_service import auth_service
+from db.auth_crud import get_user_by_id
 from db.chat_crud import ChatCRUD
+from utils.membership_cache import is_user_in_room_cached
 from models.chat import MessageType, MessageStatus
 
 router = APIRouter()
 
+# Room broadcasts send to this many sockets at once before yielding to the event loop
+BROADCAST_BATCH_SIZE = 50
+
+# Server-Sent Events watchers buffer at most this many undelivered frames
+STREAM_QUEUE_SIZE = 64
+
+def encode_message(message: dict) -> str:
+    """Serialize a WebSocket payload with orjson (handles datetime natively)"""
+    return orjson.dumps(message).decode()
+
+def reply_preview(content: str, limit: int = 100) -> str:
+    """Truncate replied-to content for the broadcast preview"""
+    preview = content[:limit + 1]
+    return preview[:limit] + "..." if len(preview) > limit else preview
+
+
+class StreamSubscriber:
+    """Queue-backed stand-in for a WebSocket, so SSE clients receive the same upload broadcasts"""
+    
+    def __init__(self):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+    
+    async def send_text(self, message: str):
+        if self.queue.full():
+            # Progress frames supersede each other; drop the oldest rather than stall the broadcast
+            self.queue.get_nowait()
+        self.queue.put_nowait(message)
+
+
 class ConnectionManager:
     """Manages WebSocket connections for real-time updates"""
     
@@ -27,6 +59,13 @@ class ConnectionManager:
         self.active_connections[file_id][websocket] = user
         print(f"📡 WebSocket connected for file: {file_id}, user: {user['email']}")
     
+    def subscribe(self, file_id: str, user: dict) -> StreamSubscriber:
+        """Register a Server-Sent Events watcher; remove it with disconnect()"""
+        subscriber = StreamSubscriber()
+        self.active_connections.setdefault(file_id, {})[subscriber] = user
+        print(f"📡 Event stream connected for file: {file_id}, user: {user['email']}")
+        return subscriber
+    
     def disconnect(self, websocket: WebSocket, file_id: str):
         """Remove WebSocket connection"""
         if file_id in self.active_connections:
@@ -39,6 +78,10 @@ class ConnectionManager:
             if not self.active_connections[file_id]:
                 del self.active_connections[file_id]
     
+    def has_watchers(self, file_id: str) -> bool:
+        """Check whether any client is watching this file"""
+        return file_id in self.active_connections
+    
     async def send_progress_update(self, file_id: str, data: dict):
         """Send progress update to all clients watching this file"""
         if file_id not in self.active_connections:
@@ -46,20 +89,20 @@ class ConnectionManager:
         
         # Add timestamp to data
         data["timestamp"] = datetime.utcnow().isoformat()
-        message = json.dumps(data)
-        
-        # Send to all connected clients for this file
-        disconnected = set()
-        for websocket in list(self.active_connections[file_id].keys()):
-            try:
-                await websocket.send_text(message)
-            except Exception:
-                # Connection is broken, mark for removal
-                disconnected.add(websocket)
+        message = encode_message(data)
+        
+        # Send to all connected clients for this file at once, so one slow
+        # watcher doesn't delay the rest; snapshot since sends are awaited
+        watchers = list(self.active_connections[file_id].keys())
+        results = await asyncio.gather(
+            *(websocket.send_text(message) for websocket in watchers),
+            return_exceptions=True
+        )
         
         # Remove broken connections
-        for websocket in disconnected:
-            self.disconnect(websocket, file_id)
+        for websocket, result in zip(watchers, results):
+            if isinstance(result, Exception):
+                self.disconnect(websocket, file_id)
     
     async def send_error(self, file_id: str, error: str):
         """Send error message to all clients watching this file"""
@@ -156,28 +199,39 @@ class ChatConnectionManager:
         sent_count = 0
         
         total_users = len(self.room_connections[room_id])
+        # Serialize once for every recipient
+        payload = encode_message(message)
         
+        # Snapshot recipients; the room can change while sends are awaited
+        recipients = []
         for user_id, websocket in self.room_connections[room_id].items():
             if exclude_user and user_id == exclude_user:
-                print(f"🚫 Excluding sender {user_id[:8]}... from broadcast")
                 continue
-                
-            try:
-                # Check if WebSocket is still open before sending
-                if websocket.client_state.value == 1:  # OPEN state
-                    await websocket.send_text(json.dumps(message))
+            # Check if WebSocket is still open before sending
+            if websocket.client_state.value == 1:  # OPEN state
+                recipients.append((user_id, websocket))
+            else:
+                print(f"❌ WebSocket closed for user {user_id[:8]}..., marking for cleanup")
+                disconnected_users.append(user_id)
+        
+        # Send in concurrent batches, yielding to the event loop between them
+        for start in range(0, len(recipients), BROADCAST_BATCH_SIZE):
+            batch = recipients[start:start + BROADCAST_BATCH_SIZE]
+            results = await asyncio.gather(
+                *(websocket.send_text(payload) for _, websocket in batch),
+                return_exceptions=True
+            )
+            for (user_id, _), result in zip(batch, results):
+                if not isinstance(result, Exception):
                     sent_count += 1
-                    print(f"✅ Sent to user {user_id[:8]}...")
-                else:
-                    print(f"❌ WebSocket closed for user {user_id[:8]}..., marking for cleanup")
-                    disconnected_users.append(user_id)
-            except Exception as e:
-                error_msg = str(e)
+                    continue
+                error_msg = str(result)
                 if "close frame" in error_msg or "ConnectionClosedError" in error_msg:
                     print(f"❌ WebSocket connection closed for user {user_id[:8]}...")
                 else:
-                    print(f"❌ Error sending to user {user_id[:8]}...: {e}")
+                    print(f"❌ Error sending to user {user_id[:8]}...: {result}")
                 disconnected_users.append(user_id)
+            await asyncio.sleep(0)
         
         # Clean up disconnected users
         for user_id in disconnected_users:
@@ -195,7 +249,7 @@ class ChatConnectionManager:
             try:
                 # Check if WebSocket is still open
                 if websocket.client_state.value == 1:  # OPEN state
-                    await websocket.send_text(json.dumps(message))
+                    await websocket.send_text(encode_message(message))
                     return True
                 else:
                     print(f"WebSocket closed for user {user_id}, cleaning up connection")
@@ -209,6 +263,24 @@ class ChatConnectionManager:
                 self.disconnect_from_room(room_id, user_id)
         return False
     
+    async def notify_users(self, user_ids: List[str], message: dict) -> int:
+        """Send a message to every open socket of the given users; returns the number delivered"""
+        # Serialize once and send to all sockets concurrently
+        payload = encode_message(message)
+        sockets = [
+            websocket
+            for user_id in user_ids
+            for websocket in list(self.user_connections.get(user_id, {}).values())
+        ]
+        results = await asyncio.gather(
+            *(websocket.send_text(payload) for websocket in sockets),
+            return_exceptions=True
+        )
+        failed = sum(isinstance(result, Exception) for result in results)
+        if failed:
+            print(f"⚠️ Failed to deliver {message.get('type')} to {failed} of {len(sockets)} sockets")
+        return len(sockets) - failed
+    
     async def get_online_users_in_room(self, room_id: str) -> List[dict]:
         """Get list of online users in a room"""
         online_users = []
@@ -252,7 +324,6 @@ async def websocket_upload_progress(
             return
             
         # Get user from database to verify they exist
-        from db.auth_crud import get_user_by_id
         user = await get_user_by_id(user_id)
         if not user:
             await websocket.close(code=4001, reason="User not found")
@@ -273,7 +344,7 @@ async def websocket_upload_progress(
     
     try:
         # Send initial connection confirmation
-        await websocket.send_text(json.dumps({
+        await websocket.send_text(encode_message({
             "type": "connected",
             "file_id": file_id,
             "user_id": user_info["id"],
@@ -289,18 +360,18 @@ async def websocket_upload_progress(
                 
                 # Handle client messages if needed
                 try:
-                    client_message = json.loads(data)
+                    client_message = orjson.loads(data)
                     if client_message.get("type") == "ping":
-                        await websocket.send_text(json.dumps({
+                        await websocket.send_text(encode_message({
                             "type": "pong",
                             "timestamp": datetime.utcnow().isoformat()
                         }))
-                except json.JSONDecodeError:
+                except orjson.JSONDecodeError:
                     pass
                     
             except asyncio.TimeoutError:
                 # Send heartbeat to keep connection alive
-                await websocket.send_text(json.dumps({
+                await websocket.send_text(encode_message({
                     "type": "heartbeat",
                     "timestamp": datetime.utcnow().isoformat()
                 }))
@@ -329,7 +400,6 @@ async def websocket_chat_general(websocket: WebSocket, token: str = Query(...)):
             return
         
         # Get user info with retry logic
-        from db.auth_crud import get_user_by_id
         user = await get_user_by_id(user_id)
         if not user:
             print(f"User {user_id} not found in database after retries")
@@ -343,7 +413,7 @@ async def websocket_chat_general(websocket: WebSocket, token: str = Query(...)):
         
         # Send connection confirmation with error handling
         try:
-            await websocket.send_text(json.dumps({
+            await websocket.send_text(encode_message({
                 "type": "connected",
                 "user_id": user_id,
                 "username": username,
@@ -359,17 +429,17 @@ async def websocket_chat_general(websocket: WebSocket, token: str = Query(...)):
                 # ✅ RECEIVE AND HANDLE CLIENT MESSAGES WITH TIMEOUT
                 try:
                     data = await asyncio.wait_for(websocket.receive_text(), timeout=60.0)
-                    message_data = json.loads(data)
+                    message_data = orjson.loads(data)
                     
                     message_type = message_data.get("type")
                     
                     if message_type == "ping":
-                        await websocket.send_text(json.dumps({
+                        await websocket.send_text(encode_message({
                             "type": "pong",
                             "timestamp": datetime.utcnow().isoformat()
                         }))
                     elif message_type == "heartbeat":
-                        await websocket.send_text(json.dumps({
+                        await websocket.send_text(encode_message({
                             "type": "heartbeat_ack",
                             "timestamp": datetime.utcnow().isoformat()
                         }))
@@ -377,7 +447,7 @@ async def websocket_chat_general(websocket: WebSocket, token: str = Query(...)):
                 except asyncio.TimeoutError:
                     # Check if connection is still alive
                     try:
-                        await websocket.send_text(json.dumps({
+                        await websocket.send_text(encode_message({
                             "type": "server_ping",
                             "timestamp": datetime.utcnow().isoformat()
                         }))
@@ -398,7 +468,6 @@ async def websocket_chat_general(websocket: WebSocket, token: str = Query(...)):
             pass
     except Exception as e:
         print(f"General Chat WebSocket connection error: {e}")
-        import traceback
         traceback.print_exc()
         try:
             await websocket.close(code=4000, reason="Internal server error")
@@ -420,7 +489,6 @@ async def websocket_chat_endpoint(websocket: WebSocket, room_id: str, token: str
             return
         
         # Get user info with retry logic
-        from db.auth_crud import get_user_by_id
         user = await get_user_by_id(user_id)
         if not user:
             await websocket.close(code=4001, reason="User not found or database unavailable")
@@ -432,7 +500,7 @@ async def websocket_chat_endpoint(websocket: WebSocket, room_id: str, token: str
         # ✅ CHECK ROOM MEMBERSHIP WITH DETAILED DEBUGGING
         try:
             print(f"🔍 Checking room membership: User {username} ({user_id[:8]}...) -> Room {room_id[:8]}...")
-            is_member = await ChatCRUD.is_user_in_room(user_id, room_id)
+            is_member = await is_user_in_room_cached(user_id, room_id)
             print(f"🔍 Membership result: {is_member}")
             
             if not is_member:
@@ -477,7 +545,7 @@ async def websocket_chat_endpoint(websocket: WebSocket, room_id: str, token: str
         # Send connection confirmation with room info (non-fatal if this send fails)
         try:
             online_users = await chat_manager.get_online_users_in_room(room_id)
-            await websocket.send_text(json.dumps({
+            await websocket.send_text(encode_message({
                 "type": "connected",
                 "room_id": room_id,
                 "user_id": user_id,
@@ -505,7 +573,7 @@ async def websocket_chat_endpoint(websocket: WebSocket, room_id: str, token: str
                 # ✅ RECEIVE AND HANDLE CLIENT MESSAGES WITH TIMEOUT
                 try:
                     data = await asyncio.wait_for(websocket.receive_text(), timeout=60.0)
-                    message_data = json.loads(data)
+                    message_data = orjson.loads(data)
                     
                     message_type = message_data.get("type")
                     print(f"📨 WebSocket message received: {message_type} from {username}")
@@ -519,7 +587,7 @@ async def websocket_chat_endpoint(websocket: WebSocket, room_id: str, token: str
                         await handle_read_receipt(room_id, user_id, message_data)
                     elif message_type == "ping":
                         try:
-                            await websocket.send_text(json.dumps({
+                            await websocket.send_text(encode_message({
                                 "type": "pong",
                                 "timestamp": datetime.utcnow().isoformat()
                             }))
@@ -532,7 +600,7 @@ async def websocket_chat_endpoint(websocket: WebSocket, room_id: str, token: str
                 except asyncio.TimeoutError:
                     # Check if connection is still alive with server ping
                     try:
-                        await websocket.send_text(json.dumps({
+                        await websocket.send_text(encode_message({
                             "type": "server_ping",
                             "timestamp": datetime.utcnow().isoformat()
                         }))
@@ -578,25 +646,27 @@ async def handle_text_message(room_id: str, sender_id: str, sender_username: str
             
         reply_to_id = message_data.get("reply_to_id")
         
-        # Save message to database
-        message = await ChatCRUD.send_text_message(
+        # Save message to database, fetching the replied-to message alongside the insert
+        send = ChatCRUD.send_text_message(
             sender_id=sender_id,
             room_id=room_id,
             content=content,
             reply_to_id=reply_to_id
         )
+        if reply_to_id:
+            message, reply_msg = await asyncio.gather(send, ChatCRUD.get_message_by_id(reply_to_id))
+        else:
+            message, reply_msg = await send, None
         
         # Get reply context if exists
         reply_context = None
-        if reply_to_id:
-            reply_msg = await ChatCRUD.get_message_by_id(reply_to_id)
-            if reply_msg:
-                reply_context = {
-                    "id": reply_msg["id"],
-                    "content": reply_msg["content"][:100] + ("..." if len(reply_msg["content"]) > 100 else ""),
-                    "sender_username": reply_msg.get("sender_username", "Unknown"),
-                    "message_type": reply_msg["message_type"]
-                }
+        if reply_msg:
+            reply_context = {
+                "id": reply_msg["id"],
+                "content": reply_preview(reply_msg.get("content") or ""),
+                "sender_username": reply_msg.get("sender_username", "Unknown"),
+                "message_type": reply_msg["message_type"]
+            }
         
         # ✅ BROADCAST MESSAGE TO ALL ROOM MEMBERS
         broadcast_message = {
@@ -618,9 +688,11 @@ async def handle_text_message(room_id: str, sender_id: str, sender_username: str
         
         # Mark as delivered for all room members
         member_ids = await ChatCRUD.get_room_member_ids(room_id)
-        for member_id in member_ids:
-            if member_id != sender_id:  # Don't mark as delivered for sender
-                await ChatCRUD.mark_message_status(message["id"], member_id, MessageStatus.DELIVERED.value)
+        await ChatCRUD.mark_message_status_bulk(
+            message["id"],
+            [member_id for member_id in member_ids if member_id != sender_id],  # Not the sender
+            MessageStatus.DELIVERED.value
+        )
         
     except Exception as e:
         print(f"Error handling text message: {e}")
@@ -1,12 +1,18 @@
 import hashlib
 import secrets
+import time
 from datetime import datetime, timedelta
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Tuple
 import jwt
 from passlib.context import CryptContext
 from fastapi import HTTPException, status
 from config import settings
 
+# Refresh tokens are a few hundred bytes; anything far larger is rejected unparsed
+MAX_TOKEN_LENGTH = 4096
+REFRESH_CACHE_TTL_SECONDS = 60
+REFRESH_CACHE_MAX_SIZE = 4096
+
 class AuthService:
     def __init__(self):
         # Use bcrypt with specific configuration to avoid version issues
@@ -16,6 +22,9 @@ class AuthService:
             bcrypt__rounds=12
         )
         self.login_attempts: Dict[str, Dict[str, Any]] = {}
+        self.login_attempt_timeout_seconds = settings.LOGIN_ATTEMPT_TIMEOUT_MINUTES * 60
+        # Recently verified refresh tokens: {token: (valid_until_monotonic, payload)}
+        self.refresh_token_cache: Dict[str, Tuple[float, Dict[str, Any]]] = {}
     
     def hash_password(self, password: str) -> str:
         """Hash a password using bcrypt"""
@@ -87,41 +96,55 @@ class AuthService:
                 detail="Invalid token"
             )
     
+    def verify_refresh_token(self, token: str) -> Dict[str, Any]:
+        """Verify a refresh token, rejecting malformed tokens before any JWT parsing"""
+        if len(token) > MAX_TOKEN_LENGTH or token.count(".") != 2:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Invalid token"
+            )
+        
+        now = time.monotonic()
+        cached = self.refresh_token_cache.get(token)
+        if cached and cached[0] > now:
+            return cached[1]
+        
+        payload = self.verify_token(token, "refresh")
+        
+        # Never cache a payload beyond the token's own expiry
+        ttl = min(REFRESH_CACHE_TTL_SECONDS, payload.get("exp", 0) - time.time())
+        if ttl > 0:
+            if len(self.refresh_token_cache) >= REFRESH_CACHE_MAX_SIZE:
+                # Evict the oldest entry (dicts keep insertion order)
+                self.refresh_token_cache.pop(next(iter(self.refresh_token_cache)))
+            self.refresh_token_cache[token] = (now + ttl, payload)
+        
+        return payload
+    
     def check_login_attempts(self, email: str) -> bool:
         """Check if user has exceeded login attempts"""
-        now = datetime.utcnow()
+        attempt_data = self.login_attempts.get(email)
+        if attempt_data is None:
+            return True
         
-        if email in self.login_attempts:
-            attempt_data = self.login_attempts[email]
-            
-            # Reset attempts if timeout period has passed
-            if now > attempt_data["timeout_until"]:
-                del self.login_attempts[email]
-                return True
-            
-            # Check if max attempts exceeded
-            if attempt_data["count"] >= settings.MAX_LOGIN_ATTEMPTS:
-                return False
+        # Reset attempts if timeout period has passed
+        if time.monotonic() > attempt_data["timeout_until"]:
+            del self.login_attempts[email]
+            return True
         
-        return True
+        # Check if max attempts exceeded
+        return attempt_data["count"] < settings.MAX_LOGIN_ATTEMPTS
     
     def record_login_attempt(self, email: str, success: bool):
         """Record a login attempt"""
-        now = datetime.utcnow()
-        
         if success:
             # Remove failed attempts on successful login
-            if email in self.login_attempts:
-                del self.login_attempts[email]
+            self.login_attempts.pop(email, None)
         else:
-            # Record failed attempt
-            if email not in self.login_attempts:
-                self.login_attempts[email] = {"count": 0, "timeout_until": now}
-            
-            self.login_attempts[email]["count"] += 1
-            self.login_attempts[email]["timeout_until"] = now + timedelta(
-                minutes=settings.LOGIN_ATTEMPT_TIMEOUT_MINUTES
-            )
+            # Record failed attempt (monotonic seconds avoid datetime arithmetic per attempt)
+            attempt_data = self.login_attempts.setdefault(email, {"count": 0, "timeout_until": 0.0})
+            attempt_data["count"] += 1
+            attempt_data["timeout_until"] = time.monotonic() + self.login_attempt_timeout_seconds
     
     def generate_reset_token(self) -> str:
         """Generate a secure reset token"""
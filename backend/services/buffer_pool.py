@@ -0,0 +1,38 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable
+
+from config import settings
+
+class BufferPool:
+    """Fixed set of reusable copy buffers shared by all uploads"""
+    
+    def __init__(self, count: int, size: int):
+        self.size = size
+        # Own threads for chunk I/O, one per buffer, so copies never queue behind
+        # database calls and other work on the default to_thread pool
+        self._executor = ThreadPoolExecutor(max_workers=count, thread_name_prefix="chunk-io")
+        self._buffers: asyncio.Queue = asyncio.Queue()
+        for _ in range(count):
+            self._buffers.put_nowait(bytearray(size))
+    
+    async def acquire(self) -> bytearray:
+        """Take a buffer, waiting while all of them are in use"""
+        return await self._buffers.get()
+    
+    def release(self, buffer: bytearray) -> None:
+        """Return a buffer to the pool"""
+        self._buffers.put_nowait(buffer)
+    
+    async def run_in_thread(self, func: Callable[..., Any], *args: Any) -> Any:
+        """Run a blocking copy on a chunk I/O thread with a pooled buffer as its last argument"""
+        buffer = await self.acquire()
+        loop = asyncio.get_running_loop()
+        task = asyncio.ensure_future(loop.run_in_executor(self._executor, partial(func, *args, buffer)))
+        # Return the buffer only once the thread is done with it, even if the caller is cancelled
+        task.add_done_callback(lambda _: self.release(buffer))
+        return await asyncio.shield(task)
+
+# Global buffer pool instance; memory is capped at COPY_BUFFER_COUNT * COPY_BUFFER_SIZE
+buffer_pool = BufferPool(settings.COPY_BUFFER_COUNT, settings.COPY_BUFFER_SIZE)
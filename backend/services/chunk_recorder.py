@@ -0,0 +1,90 @@
+import asyncio
+from functools import partial
+from typing import Dict, Iterable, Optional, Set
+
+from db.crud import mark_chunks_uploaded, update_upload_progress
+from services.chunk_service import chunk_service
+
+class ChunkRecorder:
+    """Write-behind buffer for uploaded-chunk rows and progress, written at most once per interval per upload"""
+    
+    def __init__(self, interval: float = 0.2):
+        self.interval = interval
+        # Chunk numbers saved to disk but not yet recorded, per file_id
+        self._pending: Dict[str, Set[int]] = {}
+        self._totals: Dict[str, int] = {}
+        self._timers: Dict[str, asyncio.Task] = {}
+        # Latest write per file_id, kept until it finishes so flush/discard can wait for it;
+        # each write waits for the one before it
+        self._writing: Dict[str, asyncio.Task] = {}
+        # Uploads discarded while a write was in flight; that write sends nothing more
+        self._discarded: Set[str] = set()
+    
+    def record(self, file_id: str, chunk_numbers: Iterable[int], total_chunks: int) -> None:
+        """Queue saved chunks; they are written with one upsert and one progress update per interval"""
+        self._pending.setdefault(file_id, set()).update(chunk_numbers)
+        self._totals[file_id] = total_chunks
+        if file_id not in self._timers:
+            self._timers[file_id] = asyncio.create_task(self._flush_later(file_id))
+    
+    async def flush(self, file_id: str) -> None:
+        """Write any queued chunks for file_id now and wait for earlier writes, e.g. before completing the upload"""
+        self._cancel_timer(file_id)
+        await asyncio.shield(self._start_write(file_id))
+    
+    async def discard(self, file_id: str) -> None:
+        """Drop queued chunks without writing them and wait out any write in flight, e.g. when the upload is cancelled"""
+        self._cancel_timer(file_id)
+        self._pending.pop(file_id, None)
+        self._totals.pop(file_id, None)
+        writing = self._writing.get(file_id)
+        if writing:
+            # A write already sent to the database can't be recalled; skip the rest of it
+            # and return only once it is over, so the caller's own update lands last
+            self._discarded.add(file_id)
+            try:
+                await asyncio.wait({writing})
+            finally:
+                self._discarded.discard(file_id)
+    
+    def _cancel_timer(self, file_id: str) -> None:
+        # Timers leave _timers before they start writing, so this only ever cancels a sleep
+        timer = self._timers.pop(file_id, None)
+        if timer:
+            timer.cancel()
+    
+    async def _flush_later(self, file_id: str) -> None:
+        await asyncio.sleep(self.interval)
+        self._timers.pop(file_id, None)
+        await self._start_write(file_id)
+    
+    def _start_write(self, file_id: str) -> asyncio.Task:
+        task = asyncio.create_task(self._write(file_id, self._writing.get(file_id)))
+        self._writing[file_id] = task
+        task.add_done_callback(partial(self._write_done, file_id))
+        return task
+    
+    def _write_done(self, file_id: str, task: asyncio.Task) -> None:
+        if self._writing.get(file_id) is task:
+            del self._writing[file_id]
+    
+    async def _write(self, file_id: str, previous: Optional[asyncio.Task]) -> None:
+        if previous:
+            await asyncio.wait({previous})
+        chunk_numbers = self._pending.pop(file_id, None)
+        total_chunks = self._totals.pop(file_id, None)
+        if not chunk_numbers:
+            return
+        try:
+            await mark_chunks_uploaded(file_id, sorted(chunk_numbers))
+            if file_id in self._discarded:
+                return
+            # The in-memory count already includes every chunk saved so far
+            uploaded_chunks = chunk_service.uploaded_chunk_count(file_id)
+            if chunk_service.should_persist_progress(file_id, uploaded_chunks, total_chunks):
+                await update_upload_progress(file_id, uploaded_chunks, total_chunks, monotonic=True)
+        except Exception as e:
+            print(f"Error recording uploaded chunks for {file_id}: {e}")
+
+# Global chunk recorder instance
+chunk_recorder = ChunkRecorder()
@@ -1,208 +1,210 @@
-import hashlib
 import asyncio
-import aiofiles
+import errno
+from concurrent.futures import ThreadPoolExecutor, wait
 from pathlib import Path
-from typing import List, Optional, Dict, Set
+from itertools import accumulate, compress
+from typing import Iterable, List, Optional, Dict, Set, Tuple
 from fastapi import UploadFile, HTTPException
 import time
 import os
+import logging
+import secrets
 import tempfile
 
 from config import settings
+from services.buffer_pool import buffer_pool
 from services.network_monitor import network_monitor
-from utils.hash_utils import compute_file_hash
+from utils.file_utils import copy_upload_with_hash
+from utils.hash_utils import TreeHasher, hash_file_with_tree_sync
+
+logger = logging.getLogger(__name__)
+
+# Number of stale upload directories removed at once
+STALE_CLEANUP_CONCURRENCY = 8
+
+# Upload progress is persisted about once per 1% of chunks, or after this long without a write
+PROGRESS_PERSIST_STEPS = 100
+PROGRESS_PERSIST_INTERVAL_SECONDS = 0.5
+
+# Chunks copied into the merged file at once, each to its own offset
+MERGE_COPY_CONCURRENCY = 4
+# Separate from the chunk-io pool, which the merge itself runs on
+_merge_executor = ThreadPoolExecutor(max_workers=MERGE_COPY_CONCURRENCY, thread_name_prefix="chunk-merge")
+# copy_file_range cannot copy between these files here (old kernel, cross-filesystem)
+_KERNEL_COPY_UNSUPPORTED = (errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP)
+
+# bytes.translate table flipping a 0/1 chunk bitmap
+_INVERT_FLAG = bytes([1, 0]) + bytes(254)
 
 class ChunkService:
     def __init__(self):
         self.active_uploads: Dict[str, Set[int]] = {}
-        self.chunk_locks: Dict[str, asyncio.Lock] = {}
+        # Uploads whose chunk directory has been created and scanned in this process
+        self.chunk_dirs: Set[str] = set()
+        # In-flight directory setup per upload, awaited by every concurrent first chunk
+        self.seeding: Dict[str, asyncio.Task] = {}
+        # Last persisted progress per upload: {file_id: (uploaded_chunks, monotonic time)}
+        self.persisted_progress: Dict[str, Tuple[int, float]] = {}
     
-    async def save_chunk_with_verification(
+    async def save_chunk_streaming(
         self, 
         file_id: str, 
         chunk_number: int, 
-        chunk_data: bytes,
+        chunk: UploadFile,
         expected_hash: str,
-        max_retries: int = 3
+        max_retries: int = 3,
+        hash_algorithm: str = "sha256"
     ) -> bool:
-        """Save chunk with integrity verification and retry logic"""
+        """Stream an uploaded chunk to disk, hashing it in the same pass, with retry logic"""
         
-        try:
-            print(f"Starting chunk save: file_id={file_id}, chunk_number={chunk_number}, size={len(chunk_data)}")
-            
-            # Get or create lock for this file
-            if file_id not in self.chunk_locks:
-                self.chunk_locks[file_id] = asyncio.Lock()
-            
-            async with self.chunk_locks[file_id]:
-                # Verify chunk hash immediately
-                computed_hash = hashlib.sha256(chunk_data).hexdigest()
-                if computed_hash != expected_hash:
-                    raise ValueError(f"Chunk {chunk_number} hash mismatch. Expected: {expected_hash}, Got: {computed_hash}")
-                
-                # Prepare paths
-                file_dir = settings.TEMP_DIR / file_id
-                print(f"Creating directory: {file_dir}")
-                try:
-                    file_dir.mkdir(exist_ok=True)
-                    print(f"DEBUG: Directory created successfully: {file_dir}")
-                except Exception as e:
-                    print(f"ERROR: Failed to create directory {file_dir}: {e}")
-                    raise
-                
-                chunk_path = file_dir / f"chunk_{chunk_number}"
-                temp_chunk_path = file_dir / f"chunk_{chunk_number}.tmp"
-                print(f"DEBUG: Paths prepared - chunk: {chunk_path}, temp: {temp_chunk_path}")
+        # Chunks of one upload may arrive concurrently and out of order; each
+        # attempt writes its own temp file and publishes it by atomic rename, so
+        # no per-upload lock is needed and a duplicate chunk simply overwrites
+        if file_id not in self.chunk_dirs:
+            await self._ensure_chunk_dir(file_id)
+        
+        file_dir = settings.TEMP_DIR / file_id
+        chunk_path = file_dir / f"chunk_{chunk_number}"
+        
+        for attempt in range(max_retries):
+            start_time = time.time()
+            temp_chunk_path = file_dir / f"chunk_{chunk_number}.{secrets.token_hex(4)}.tmp"
+            try:
+                # Every filesystem call for the chunk happens in this one worker thread hop;
+                # fixed-size reads keep memory per request flat whatever the chunk size
+                computed_hash, size = await buffer_pool.run_in_thread(
+                    self._store_chunk_sync,
+                    chunk, str(temp_chunk_path), str(chunk_path), expected_hash, hash_algorithm
+                )
+            except Exception as e:
+                print(f"Chunk save attempt {attempt + 1} failed: {str(e)}")
+                network_monitor.record_upload(chunk.size or 0, time.time() - start_time, False)
                 
-                # Clean up any existing incomplete chunks
-                try:
-                    print(f"DEBUG: Starting cleanup of incomplete chunks")
-                    await self._cleanup_incomplete_chunk(chunk_path, temp_chunk_path)
-                    print(f"DEBUG: Cleanup completed successfully")
-                except Exception as e:
-                    print(f"ERROR: Cleanup failed: {e}")
-                    raise
+                if attempt == max_retries - 1:
+                    raise HTTPException(
+                        status_code=500,
+                        detail=f"Failed to save chunk {chunk_number} after {max_retries} attempts: {str(e)}"
+                    )
                 
-                # Attempt to save with retries
-                for attempt in range(max_retries):
-                    try:
-                        start_time = time.time()
-                        print(f"DEBUG: Starting chunk write attempt {attempt + 1}")
-                        
-                        # Atomic write operation
-                        try:
-                            print(f"DEBUG: Opening file for write: {temp_chunk_path}")
-                            async with aiofiles.open(temp_chunk_path, 'wb') as f:
-                                print(f"DEBUG: Writing {len(chunk_data)} bytes to file")
-                                await f.write(chunk_data)
-                                # Force write to disk (aiofiles doesn't support fsync directly)
-                                await f.flush()
-                            print(f"DEBUG: File write completed successfully")
-                        except Exception as e:
-                            print(f"ERROR: File write failed: {e}")
-                            raise
-                        
-                        # Verify written data
-                        try:
-                            print(f"DEBUG: Starting chunk integrity verification")
-                            if not await self._verify_chunk_integrity(temp_chunk_path, chunk_data, expected_hash):
-                                raise ValueError(f"Chunk {chunk_number} failed post-write verification")
-                            print(f"DEBUG: Chunk integrity verified successfully")
-                        except Exception as e:
-                            print(f"ERROR: Chunk verification failed: {e}")
-                            raise
-                        
-                        # Atomic rename
-                        try:
-                            print(f"DEBUG: Starting atomic rename from {temp_chunk_path} to {chunk_path}")
-                            temp_chunk_path.rename(chunk_path)
-                            print(f"DEBUG: Atomic rename completed successfully")
-                        except Exception as e:
-                            print(f"ERROR: Atomic rename failed: {e}")
-                            raise
-                        
-                        # Record successful upload metrics
-                        try:
-                            print(f"DEBUG: Recording upload metrics")
-                            upload_time = time.time() - start_time
-                            network_monitor.record_upload(len(chunk_data), upload_time, True)
-                            print(f"DEBUG: Upload metrics recorded successfully")
-                        except Exception as e:
-                            print(f"ERROR: Failed to record upload metrics: {e}")
-                            raise
-                        
-                        # Track active upload
-                        try:
-                            print(f"DEBUG: Tracking active upload")
-                            if file_id not in self.active_uploads:
-                                self.active_uploads[file_id] = set()
-                            self.active_uploads[file_id].add(chunk_number)
-                            print(f"DEBUG: Active upload tracked successfully")
-                        except Exception as e:
-                            print(f"ERROR: Failed to track active upload: {e}")
-                            raise
-                        
-                        print(f"DEBUG: Chunk save completed successfully, returning True")
-                        return True
-                        
-                    except Exception as e:
-                        print(f"Chunk save attempt {attempt + 1} failed: {str(e)}")
-                        # Record failed attempt
-                        upload_time = time.time() - start_time
-                        network_monitor.record_upload(len(chunk_data), upload_time, False)
-                        
-                        # Clean up failed attempt
-                        await self._cleanup_incomplete_chunk(chunk_path, temp_chunk_path)
-                        
-                        if attempt == max_retries - 1:
-                            raise HTTPException(
-                                status_code=500,
-                                detail=f"Failed to save chunk {chunk_number} after {max_retries} attempts: {str(e)}"
-                            )
-                        
-                        # Exponential backoff
-                        await asyncio.sleep(2 ** attempt)
-                        
-                return False
+                # Exponential backoff
+                await asyncio.sleep(2 ** attempt)
+                continue
+            
+            if computed_hash != expected_hash:
+                # The upload itself is corrupt; retrying would read the same bytes
+                raise ValueError(f"Chunk {chunk_number} hash mismatch. Expected: {expected_hash}, Got: {computed_hash}")
+            
+            network_monitor.record_upload(size, time.time() - start_time, True)
+            
+            # Track active upload (a set, so a re-sent chunk is counted once)
+            self.active_uploads.setdefault(file_id, set()).add(chunk_number)
+            return True
         
-        except Exception as e:
-            print(f"Critical error in save_chunk_with_verification: {str(e)}")
-            raise
+        return False
     
-    async def _cleanup_incomplete_chunk(self, chunk_path: Path, temp_chunk_path: Path):
-        """Remove any incomplete or corrupted chunk files"""
+    @staticmethod
+    def _store_chunk_sync(
+        chunk: UploadFile,
+        temp_chunk_path: str,
+        chunk_path: str,
+        expected_hash: str,
+        hash_algorithm: str,
+        buffer: bytearray
+    ) -> Tuple[str, int]:
+        """Copy and hash a chunk to its temp file, then publish it by atomic rename if the hash matches (blocking)"""
         try:
-            if temp_chunk_path.exists():
-                temp_chunk_path.unlink()
-            
-            # Check if existing chunk is complete and valid
-            if chunk_path.exists():
-                # If chunk exists but is corrupted/incomplete, remove it
-                stat = chunk_path.stat()
-                if stat.st_size == 0:  # Empty file
-                    chunk_path.unlink()
-                    
-        except Exception as e:
-            print(f"Warning: Could not clean up chunk files: {e}")
+            computed_hash, size = copy_upload_with_hash(chunk, temp_chunk_path, None, buffer, hash_algorithm)
+            if computed_hash == expected_hash:
+                # Replaces any earlier (possibly partial) copy of this chunk
+                os.replace(temp_chunk_path, chunk_path)
+                return computed_hash, size
+        except BaseException:
+            ChunkService._unlink_quietly(temp_chunk_path)
+            raise
+        ChunkService._unlink_quietly(temp_chunk_path)
+        return computed_hash, size
+    
+    @staticmethod
+    def find_missing_chunks(uploaded_chunks: Iterable[int], total_chunks: int) -> List[int]:
+        """List chunk numbers below total_chunks that have not been uploaded, in order"""
+        # One byte per chunk instead of two sets of Python ints
+        missing = bytearray(b"\x01") * total_chunks
+        for chunk_number in uploaded_chunks:
+            if 0 <= chunk_number < total_chunks:
+                missing[chunk_number] = 0
+        return list(compress(range(total_chunks), missing))
+    
+    @staticmethod
+    def split_chunks(uploaded_chunks: Iterable[int], total_chunks: int) -> Tuple[List[int], List[int]]:
+        """Sorted (uploaded, missing) chunk numbers below total_chunks, from one bitmap pass"""
+        uploaded = bytearray(total_chunks)
+        for chunk_number in uploaded_chunks:
+            if 0 <= chunk_number < total_chunks:
+                uploaded[chunk_number] = 1
+        missing = uploaded.translate(_INVERT_FLAG)
+        chunk_numbers = range(total_chunks)
+        return list(compress(chunk_numbers, uploaded)), list(compress(chunk_numbers, missing))
     
-    async def _verify_chunk_integrity(self, file_path: Path, original_data: bytes, expected_hash: str) -> bool:
-        """Verify chunk integrity after writing to disk"""
+    def uploaded_chunk_count(self, file_id: str) -> int:
+        """Number of distinct chunks saved for an upload, without scanning disk or the database"""
+        return len(self.active_uploads.get(file_id, ()))
+    
+    async def _ensure_chunk_dir(self, file_id: str) -> None:
+        """Create and scan an upload's chunk directory once, however many chunks arrive together"""
+        task = self.seeding.get(file_id)
+        if task is None:
+            task = self.seeding[file_id] = asyncio.ensure_future(self._seed_chunk_dir(file_id))
         try:
-            # Check file exists and has correct size
-            if not file_path.exists():
-                return False
-            
-            stat = file_path.stat()
-            if stat.st_size != len(original_data):
-                return False
-            
-            # Verify hash of written data
-            async with aiofiles.open(file_path, 'rb') as f:
-                written_data = await f.read()
-            
-            written_hash = hashlib.sha256(written_data).hexdigest()
-            return written_hash == expected_hash
-            
+            await asyncio.shield(task)
         except Exception:
-            return False
+            # Let the next chunk try again
+            if self.seeding.get(file_id) is task:
+                del self.seeding[file_id]
+            raise
+    
+    async def _seed_chunk_dir(self, file_id: str) -> None:
+        # cleanup_chunks forgets the directory along with it
+        await asyncio.to_thread((settings.TEMP_DIR / file_id).mkdir, exist_ok=True)
+        # Chunks saved before a restart are only on disk; merge rather than assign,
+        # since chunks saved while the scan ran are already in the set
+        scanned = await self.get_uploaded_chunks(file_id)
+        self.active_uploads.setdefault(file_id, set()).update(scanned)
+        self.chunk_dirs.add(file_id)
+        self.seeding.pop(file_id, None)
     
     async def get_uploaded_chunks(self, file_id: str) -> List[int]:
-        """Get list of successfully uploaded chunks"""
-        file_dir = settings.TEMP_DIR / file_id
-        if not file_dir.exists():
-            return []
-        
+        """Get list of successfully uploaded chunks, scanning the chunk directory off the event loop"""
+        return await asyncio.to_thread(self._scan_uploaded_chunks, settings.TEMP_DIR / file_id)
+    
+    async def known_uploaded_chunks(self, file_id: str) -> List[int]:
+        """Uploaded chunks from the in-memory tracking once it is seeded from disk, else from disk"""
+        seeding = self.seeding.get(file_id)
+        if seeding:
+            # Until the first chunk's disk scan is merged in, the set may be missing
+            # chunks saved before a restart
+            await asyncio.wait({seeding})
+        if file_id in self.chunk_dirs:
+            return sorted(self.active_uploads.get(file_id, ()))
+        return await self.get_uploaded_chunks(file_id)
+    
+    @staticmethod
+    def _scan_uploaded_chunks(file_dir: Path) -> List[int]:
         uploaded_chunks = []
-        for chunk_file in file_dir.glob("chunk_*"):
-            if chunk_file.suffix != ".tmp":  # Ignore temporary files
-                try:
-                    chunk_number = int(chunk_file.name.split("_")[1])
-                    
-                    # Verify chunk is complete (not zero bytes)
-                    if chunk_file.stat().st_size > 0:
-                        uploaded_chunks.append(chunk_number)
-                except (ValueError, IndexError):
-                    continue
+        try:
+            with os.scandir(file_dir) as entries:
+                for entry in entries:
+                    name = entry.name
+                    if not name.startswith("chunk_") or name.endswith(".tmp"):  # Ignore temporary files
+                        continue
+                    try:
+                        chunk_number = int(name[len("chunk_"):])
+                        # Verify chunk is complete (not zero bytes)
+                        if entry.stat().st_size > 0:
+                            uploaded_chunks.append(chunk_number)
+                    except (ValueError, OSError):
+                        continue
+        except FileNotFoundError:
+            return []
         
         return sorted(uploaded_chunks)
     
@@ -212,21 +214,20 @@ class ChunkService:
         total_chunks: int, 
         expected_file_hash: str,
         filename: str
-    ) -> tuple[Optional[Path], str]:
-        """Merge chunks and verify final file integrity"""
+    ) -> tuple[Optional[Path], str, Optional[str]]:
+        """Merge chunks and verify final file integrity; also returns the tree hash of large files"""
         
-        print(f"DEBUG: merge_chunks_with_verification called with file_id={file_id}, total_chunks={total_chunks}, filename={filename}")
+        logger.debug("merge_chunks_with_verification called with file_id=%s, total_chunks=%s, filename=%s", file_id, total_chunks, filename)
         
         # Verify all chunks are present
         uploaded_chunks = await self.get_uploaded_chunks(file_id)
-        expected_chunks = set(range(total_chunks))
-        print(f"DEBUG: uploaded_chunks={uploaded_chunks}, expected_chunks={expected_chunks}")
+        logger.debug("uploaded_chunks=%s, total_chunks=%s", uploaded_chunks, total_chunks)
         
-        if set(uploaded_chunks) != expected_chunks:
-            missing_chunks = expected_chunks - set(uploaded_chunks)
+        missing_chunks = self.find_missing_chunks(uploaded_chunks, total_chunks)
+        if missing_chunks:
             raise HTTPException(
                 status_code=400,
-                detail=f"Missing chunks: {sorted(missing_chunks)}"
+                detail=f"Missing chunks: {missing_chunks}"
             )
         
         # Merge chunks - use unique filename to avoid conflicts
@@ -238,32 +239,17 @@ class ChunkService:
         output_path = settings.UPLOAD_DIR / unique_filename
         temp_output_path = settings.UPLOAD_DIR / f"{unique_filename}.tmp"
         
-        print(f"DEBUG: output_path={output_path}, temp_output_path={temp_output_path}")
-        
-        # Ensure upload directory exists
-        settings.UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+        logger.debug("output_path=%s, temp_output_path=%s", output_path, temp_output_path)
         
         try:
-            print(f"DEBUG: Starting merge process")
-            async with aiofiles.open(temp_output_path, 'wb') as outfile:
-                for chunk_number in range(total_chunks):
-                    chunk_path = settings.TEMP_DIR / file_id / f"chunk_{chunk_number}"
-                    print(f"DEBUG: Processing chunk {chunk_number}, path: {chunk_path}")
-                    
-                    if not chunk_path.exists():
-                        print(f"ERROR: Chunk {chunk_number} not found at {chunk_path}")
-                        raise ValueError(f"Chunk {chunk_number} not found during merge")
-                    
-                    async with aiofiles.open(chunk_path, 'rb') as chunk_file:
-                        chunk_data = await chunk_file.read()
-                        print(f"DEBUG: Read {len(chunk_data)} bytes from chunk {chunk_number}")
-                        await outfile.write(chunk_data)
-            print(f"DEBUG: Merge completed, file written to {temp_output_path}")
+            # Concatenate and hash every chunk from one worker thread: copied in the kernel
+            # where supported, else through a pooled buffer
+            chunk_paths = [settings.TEMP_DIR / file_id / f"chunk_{n}" for n in range(total_chunks)]
+            computed_hash, tree_hash = await buffer_pool.run_in_thread(
+                self._merge_chunks_sync, chunk_paths, temp_output_path
+            )
             
             # Verify merged file hash
-            print(f"DEBUG: Starting hash verification for merged file")
-            computed_hash = await compute_file_hash(temp_output_path)
-            print(f"DEBUG: Computed hash: {computed_hash}, Expected hash: {expected_file_hash}")
             
             if computed_hash != expected_file_hash:
                 print(f"ERROR: Hash mismatch, removing temp file")
@@ -273,62 +259,149 @@ class ChunkService:
                     detail=f"File integrity check failed. Expected: {expected_file_hash}, Got: {computed_hash}"
                 )
             
-            print(f"DEBUG: Hash verification passed")
             
             # Atomic rename to final location
-            print(f"DEBUG: Starting atomic rename from {temp_output_path} to {output_path}")
             temp_output_path.rename(output_path)
-            print(f"DEBUG: Atomic rename completed successfully")
             
             # Clean up chunks
-            print(f"DEBUG: Starting cleanup of chunks")
             await self.cleanup_chunks(file_id)
-            print(f"DEBUG: Cleanup completed successfully")
             
-            print(f"DEBUG: Merge process completed successfully, returning: {output_path}, {computed_hash}")
-            return output_path, computed_hash
+            return output_path, computed_hash, tree_hash
             
         except Exception as e:
-            print(f"ERROR: Exception during merge process: {type(e).__name__}: {e}")
-            import traceback
-            print(f"ERROR: Full traceback: {traceback.format_exc()}")
+            logger.exception("Exception during merge process for %s", file_id)
             # Clean up temp file on error
             if temp_output_path.exists():
                 temp_output_path.unlink()
             raise e
     
+    @classmethod
+    def _merge_chunks_sync(cls, chunk_paths: List[Path], output_path: Path, buffer: bytearray) -> Tuple[str, Optional[str]]:
+        """Write chunks to output_path in order and return the SHA-256 and tree hash of the result (blocking)"""
+        if hasattr(os, "copy_file_range"):
+            try:
+                cls._merge_chunks_in_kernel(chunk_paths, output_path)
+                # One pass over the finished file for both hashes
+                return hash_file_with_tree_sync(output_path)
+            except OSError as e:
+                if e.errno not in _KERNEL_COPY_UNSUPPORTED:
+                    raise
+        return cls._merge_chunks_buffered(chunk_paths, output_path, buffer)
+    
+    @staticmethod
+    def _merge_chunks_in_kernel(chunk_paths: List[Path], output_path: Path) -> None:
+        """Copy every chunk to its offset in output_path with copy_file_range, several at once (blocking)"""
+        sizes = [os.stat(chunk_path).st_size for chunk_path in chunk_paths]
+        offsets = list(accumulate(sizes, initial=0))
+        
+        def copy_chunk(index: int, output_fd: int) -> None:
+            with open(chunk_paths[index], 'rb') as chunk_file:
+                copied, size, offset = 0, sizes[index], offsets[index]
+                while copied < size:
+                    n = os.copy_file_range(chunk_file.fileno(), output_fd, size - copied, copied, offset + copied)
+                    if n == 0:
+                        break  # chunk shrank underneath us; the hash check will fail
+                    copied += n
+        
+        with open(output_path, 'wb') as outfile:
+            output_fd = outfile.fileno()
+            if offsets[-1]:
+                try:
+                    # Reserve the whole file up front so parallel writes don't fragment it
+                    os.posix_fallocate(output_fd, 0, offsets[-1])
+                except OSError:
+                    pass
+            futures = [_merge_executor.submit(copy_chunk, i, output_fd) for i in range(len(chunk_paths))]
+            # Every copy must be finished before the descriptor is closed, even if one failed
+            wait(futures)
+            for future in futures:
+                future.result()
+    
+    @staticmethod
+    def _merge_chunks_buffered(chunk_paths: List[Path], output_path: Path, buffer: bytearray) -> Tuple[str, Optional[str]]:
+        """Copy and hash chunks into output_path through one buffer, in order (blocking)"""
+        hasher = TreeHasher()
+        view = memoryview(buffer)
+        with open(output_path, 'wb') as outfile:
+            for chunk_path in chunk_paths:
+                with open(chunk_path, 'rb') as chunk_file:
+                    while n := chunk_file.readinto(view):
+                        hasher.update(view[:n])
+                        outfile.write(view[:n])
+        return hasher.hexdigest(), hasher.tree_hexdigest()
+    
+    def should_persist_progress(self, file_id: str, uploaded_chunks: int, total_chunks: int) -> bool:
+        """Decide whether this progress update is worth a database write, and record it if so"""
+        now = time.monotonic()
+        last_count, last_time = self.persisted_progress.get(file_id, (0, 0.0))
+        stride = max(1, total_chunks // PROGRESS_PERSIST_STEPS)
+        # The final chunk is always written, so the stored count ends up exact
+        if (uploaded_chunks >= total_chunks
+                or uploaded_chunks - last_count >= stride
+                or now - last_time > PROGRESS_PERSIST_INTERVAL_SECONDS):
+            self.persisted_progress[file_id] = (uploaded_chunks, now)
+            return True
+        return False
+    
     async def cleanup_chunks(self, file_id: str):
         """Clean up temporary chunks and tracking data"""
         try:
-            file_dir = settings.TEMP_DIR / file_id
-            if file_dir.exists():
-                # Remove all chunk files
-                for chunk_file in file_dir.iterdir():
-                    chunk_file.unlink()
-                file_dir.rmdir()
+            # One worker thread scans and empties the directory; unlinks in one
+            # directory contend on its inode, so more threads would not help
+            await asyncio.to_thread(self._remove_chunk_dir, settings.TEMP_DIR / file_id)
             
             # Clean up tracking data
             if file_id in self.active_uploads:
                 del self.active_uploads[file_id]
-            if file_id in self.chunk_locks:
-                del self.chunk_locks[file_id]
+            self.chunk_dirs.discard(file_id)
+            self.seeding.pop(file_id, None)
+            self.persisted_progress.pop(file_id, None)
                 
         except Exception as e:
             print(f"Warning: Could not fully clean up chunks for {file_id}: {e}")
     
+    @staticmethod
+    def _unlink_quietly(path: str):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+    
+    @classmethod
+    def _remove_chunk_dir(cls, directory: Path) -> None:
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    cls._unlink_quietly(entry.path)
+            directory.rmdir()
+        except FileNotFoundError:
+            pass
+    
+    @staticmethod
+    def _find_stale_upload_ids(cutoff_time: float) -> List[str]:
+        # scandir entries carry their type, so only the mtime needs a stat call;
+        # names and mtimes are collected as parallel lists, then filtered in one pass
+        names: List[str] = []
+        mtimes: List[float] = []
+        with os.scandir(settings.TEMP_DIR) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    names.append(entry.name)
+                    mtimes.append(entry.stat().st_mtime)
+        return list(compress(names, [mtime < cutoff_time for mtime in mtimes]))
+    
     async def cleanup_stale_uploads(self, max_age_hours: int = 24):
         """Clean up old incomplete uploads"""
         try:
             current_time = time.time()
             cutoff_time = current_time - (max_age_hours * 3600)
             
-            for file_dir in settings.TEMP_DIR.iterdir():
-                if file_dir.is_dir():
-                    # Check if directory is old
-                    if file_dir.stat().st_mtime < cutoff_time:
-                        file_id = file_dir.name
-                        await self.cleanup_chunks(file_id)
-                        print(f"Cleaned up stale upload: {file_id}")
+            stale_ids = await asyncio.to_thread(self._find_stale_upload_ids, cutoff_time)
+            for start in range(0, len(stale_ids), STALE_CLEANUP_CONCURRENCY):
+                batch = stale_ids[start:start + STALE_CLEANUP_CONCURRENCY]
+                await asyncio.gather(*(self.cleanup_chunks(file_id) for file_id in batch))
+            if stale_ids:
+                print(f"Cleaned up {len(stale_ids)} stale uploads")
                         
         except Exception as e:
             print(f"Error during stale upload cleanup: {e}")
@@ -7,6 +7,9 @@ import statistics
 
 from config import settings
 
+# Chunk ACKs ask for the recommendation on every chunk; re-derive it at most this often
+RECOMMENDATION_REFRESH_SECONDS = 0.5
+
 @dataclass
 class UploadMetric:
     chunk_size: int # How big was the file piece (in bytes)
@@ -26,6 +29,12 @@ class NetworkMonitor:
         self.current_chunk_size = settings.DEFAULT_CHUNK_SIZE
         self.failure_count = 0
         self.consecutive_failures = 0
+        # Set when a new metric arrives; the chunk size is only re-derived then,
+        # and no sooner than RECOMMENDATION_REFRESH_SECONDS after the last time
+        self._needs_update = False
+        self._next_update = 0.0
+        self._use_concurrent: Optional[bool] = None
+        self._next_concurrent_check = 0.0
     
     def record_upload(self, chunk_size: int, upload_time: float, success: bool):
         """Record upload performance metrics"""
@@ -38,6 +47,7 @@ class NetworkMonitor:
         )
         # Add it to memory (keeps only last 20)
         self.metrics.append(metric)
+        self._needs_update = True
         
         if success:
             self.consecutive_failures = 0 # Reset failure streak
@@ -51,6 +61,14 @@ class NetworkMonitor:
         if len(self.metrics) < 3:
             return self.current_chunk_size
         
+        # Called on every chunk response and status poll; only new measurements
+        # move the size, so repeated calls neither recompute nor compound it
+        now = time.monotonic()
+        if not self._needs_update or now < self._next_update:
+            return self.current_chunk_size
+        self._needs_update = False
+        self._next_update = now + RECOMMENDATION_REFRESH_SECONDS
+        
         # Get recent successful uploads
         recent_successful = [m for m in list(self.metrics)[-10:] if m.success]
         
@@ -68,7 +86,7 @@ class NetworkMonitor:
             if not speeds:
                 # No valid speeds, return current chunk size
                 return self.current_chunk_size
-            avg_speed = statistics.mean(speeds)
+            avg_speed = statistics.fmean(speeds)
         except (statistics.StatisticsError, ValueError, ZeroDivisionError):
             # If statistics calculation fails, return current chunk size
             return self.current_chunk_size
@@ -95,6 +113,13 @@ class NetworkMonitor:
     
     def should_use_concurrent_upload(self) -> bool:
         """Determine if concurrent uploads should be used"""
+        now = time.monotonic()
+        if self._use_concurrent is None or now >= self._next_concurrent_check:
+            self._use_concurrent = self._compute_use_concurrent()
+            self._next_concurrent_check = now + RECOMMENDATION_REFRESH_SECONDS
+        return self._use_concurrent
+    
+    def _compute_use_concurrent(self) -> bool:
         if len(self.metrics) < 5:
             return False
         
@@ -110,7 +135,7 @@ class NetworkMonitor:
             speeds = [m.speed for m in successful_metrics if m.speed > 0]
             if not speeds:
                 return False
-            avg_speed = statistics.mean(speeds)
+            avg_speed = statistics.fmean(speeds)
         except (statistics.StatisticsError, ValueError, ZeroDivisionError):
             return False
         
@@ -0,0 +1,45 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+SendFunc = Callable[[dict], Awaitable[Any]]
+
+class ProgressCoalescer:
+    """Coalesces bursts of WebSocket progress updates into at most one frame per interval per key"""
+    
+    def __init__(self, interval: float = 0.1):
+        self.interval = interval
+        # Latest merged payload and its sender, per key
+        self._pending: Dict[Hashable, Tuple[SendFunc, dict]] = {}
+        self._timers: Dict[Hashable, asyncio.Task] = {}
+    
+    def update(self, key: Hashable, send: SendFunc, payload: dict) -> None:
+        """Queue a progress payload; newer fields overwrite older ones until the next flush"""
+        _, pending = self._pending.get(key, (send, {}))
+        self._pending[key] = (send, {**pending, **payload})
+        if key not in self._timers:
+            self._timers[key] = asyncio.create_task(self._flush_later(key))
+    
+    async def flush(self, key: Hashable) -> None:
+        """Send any pending update for key now, e.g. before a completion message"""
+        timer = self._timers.pop(key, None)
+        if timer:
+            timer.cancel()
+        await self._send(key)
+    
+    async def _flush_later(self, key: Hashable) -> None:
+        await asyncio.sleep(self.interval)
+        self._timers.pop(key, None)
+        await self._send(key)
+    
+    async def _send(self, key: Hashable) -> None:
+        entry = self._pending.pop(key, None)
+        if not entry:
+            return
+        send, payload = entry
+        try:
+            await send(payload)
+        except Exception as e:
+            print(f"Error sending coalesced progress update for {key}: {e}")
+
+# Global coalescer instance
+progress_coalescer = ProgressCoalescer()
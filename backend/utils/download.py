@@ -0,0 +1,81 @@
+import os
+from typing import Dict, Optional
+from urllib.parse import quote
+
+from fastapi.responses import FileResponse, Response
+
+from config import settings
+
+class LargeChunkFileResponse(FileResponse):
+    """FileResponse that sends 1MB pieces instead of Starlette's 64KB, cutting per-send overhead 16x"""
+    chunk_size = 1024 * 1024
+
+def accel_redirect_path(file_path: str) -> Optional[str]:
+    """
+    Map a stored file to its internal Nginx location.
+    
+    Args:
+        file_path: Path of a file under UPLOAD_DIR
+        
+    Returns:
+        str: The X-Accel-Redirect URI, or None when the offload is off or the file is outside UPLOAD_DIR
+    """
+    if not settings.X_ACCEL_REDIRECT_PREFIX:
+        return None
+    relative = os.path.relpath(os.path.abspath(file_path), os.path.abspath(settings.UPLOAD_DIR))
+    if relative.startswith(os.pardir):
+        return None
+    return settings.X_ACCEL_REDIRECT_PREFIX.rstrip("/") + "/" + quote(relative.replace(os.sep, "/"))
+
+def attachment_disposition(filename: str) -> str:
+    """
+    Build a Content-Disposition header value, encoded the way FileResponse does it.
+    
+    Args:
+        filename: Name the client should save the file as
+        
+    Returns:
+        str: The header value
+    """
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{filename}"'
+
+def file_download_response(
+    file_path: str,
+    filename: str,
+    file_stat: os.stat_result,
+    headers: Optional[Dict[str, str]] = None
+) -> Response:
+    """
+    Build the response that sends a stored file as an attachment.
+    
+    With X_ACCEL_REDIRECT_PREFIX set, Nginx sends the bytes with sendfile and the
+    worker is released immediately; otherwise the file is streamed in 1MB pieces.
+    
+    Args:
+        file_path: Path to the file
+        filename: Name the client should save the file as
+        file_stat: stat result for the file, so it is not stat'ed again
+        headers: Extra response headers (e.g. ETag, Cache-Control)
+        
+    Returns:
+        Response: The download response
+    """
+    internal_path = accel_redirect_path(file_path)
+    if internal_path:
+        return Response(headers={
+            **(headers or {}),
+            "X-Accel-Redirect": internal_path,
+            "Content-Type": "application/octet-stream",
+            "Content-Disposition": attachment_disposition(filename)
+        })
+    
+    return LargeChunkFileResponse(
+        path=file_path,
+        media_type='application/octet-stream',
+        filename=filename,
+        headers=headers,
+        stat_result=file_stat
+    )
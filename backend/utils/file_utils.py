@@ -1,8 +1,12 @@
+import errno
+import mmap
 import os
 import shutil
-from typing import Optional
+from typing import Optional, Tuple
 from fastapi import UploadFile
 
+from utils.hash_utils import new_chunk_hasher
+
 def save_upload_file(upload_file: UploadFile, destination: str) -> str:
     """
     Save an uploaded file to the specified destination.
@@ -23,6 +27,102 @@ def save_upload_file(upload_file: UploadFile, destination: str) -> str:
     
     return destination
 
+def copy_upload_with_hash(
+    upload_file: UploadFile, 
+    destination: str, 
+    max_size: Optional[int] = None, 
+    buffer: Optional[bytearray] = None,
+    algorithm: str = "sha256"
+) -> Optional[Tuple[str, int]]:
+    """
+    Copy an upload's spooled file to disk, computing its hash in the same pass.
+    Uploads that spilled to a temp file are copied in the kernel instead (see
+    _copy_spilled_upload_with_hash). Blocking; run it in a worker thread from async code.
+    
+    Args:
+        upload_file: The FastAPI UploadFile object
+        destination: The full path where the file should be written
+        max_size: Maximum number of bytes to accept, or None for no limit
+        buffer: Reusable buffer to read into (a 64KB one is allocated if omitted)
+        algorithm: Hash algorithm, see hash_utils.new_chunk_hasher
+        
+    Returns:
+        Tuple[str, int]: (hex digest, size in bytes), or None if the file exceeds max_size
+    """
+    source = upload_file.file
+    # SpooledTemporaryFile sets _rolled once it spills past its memory limit (1MB in Starlette)
+    if getattr(source, "_rolled", False) and hasattr(os, "sendfile"):
+        try:
+            return _copy_spilled_upload_with_hash(source, destination, max_size, algorithm)
+        except OSError as e:
+            # sendfile between regular files needs Linux 2.6.33+; copy through the buffer otherwise
+            if e.errno not in (errno.EINVAL, errno.ENOSYS, errno.ENOTSUP):
+                raise
+    
+    hasher = new_chunk_hasher(algorithm)
+    size = 0
+    source.seek(0)
+    view = memoryview(buffer if buffer is not None else bytearray(64 * 1024))
+    # SpooledTemporaryFile only implements readinto on Python 3.11+
+    readinto = getattr(source, "readinto", None)
+    
+    with open(destination, "wb") as out:
+        while True:
+            if readinto:
+                data = view[:readinto(view)]
+            else:
+                data = source.read(len(view))
+            if not data:
+                break
+            size += len(data)
+            if max_size is not None and size > max_size:
+                return None
+            hasher.update(data)
+            out.write(data)
+    
+    return hasher.hexdigest(), size
+
+def _copy_spilled_upload_with_hash(
+    source, 
+    destination: str, 
+    max_size: Optional[int], 
+    algorithm: str
+) -> Optional[Tuple[str, int]]:
+    """
+    Copy a spilled upload with sendfile and hash it through a memory map, so the
+    bytes never pass through a Python buffer. Blocking.
+    
+    Args:
+        source: The upload's rolled-over SpooledTemporaryFile
+        destination: The full path where the file should be written
+        max_size: Maximum number of bytes to accept, or None for no limit
+        algorithm: Hash algorithm, see hash_utils.new_chunk_hasher
+        
+    Returns:
+        Tuple[str, int]: (hex digest, size in bytes), or None if the file exceeds max_size
+    """
+    source.flush()
+    source_fd = source.fileno()
+    size = os.fstat(source_fd).st_size
+    if max_size is not None and size > max_size:
+        return None
+    
+    hasher = new_chunk_hasher(algorithm)
+    with open(destination, "wb") as out:
+        if size == 0:
+            return hasher.hexdigest(), 0  # empty files cannot be mapped
+        with mmap.mmap(source_fd, 0, access=mmap.ACCESS_READ) as mm:
+            with memoryview(mm) as view:
+                hasher.update(view)
+        offset = 0
+        while offset < size:
+            sent = os.sendfile(out.fileno(), source_fd, offset, size - offset)
+            if sent == 0:
+                break
+            offset += sent
+    
+    return hasher.hexdigest(), size
+
 def get_file_extension(filename: str) -> str:
     """
     Get the file extension from a filename.
@@ -0,0 +1,77 @@
+import os
+from typing import Dict, Optional, Tuple
+
+from utils.hash_utils import compute_file_hash, compute_tree_hash
+
+HASH_CACHE_MAX_SIZE = 4096
+
+# Known file hashes: {file_path: (st_mtime_ns, st_size, hex digest)}
+_cache: Dict[str, Tuple[int, int, str]] = {}
+
+def remember_file_hash(file_path: str, file_stat: os.stat_result, file_hash: str) -> None:
+    """
+    Record the hash of a file as of the given stat result.
+
+    Args:
+        file_path: Path to the file
+        file_stat: stat result taken when the hash was computed
+        file_hash: Hex digest of the file contents
+    """
+    _cache.pop(file_path, None)
+    if len(_cache) >= HASH_CACHE_MAX_SIZE:
+        # Evict the least recently used entry (dicts keep insertion order)
+        _cache.pop(next(iter(_cache)))
+    _cache[file_path] = (file_stat.st_mtime_ns, file_stat.st_size, file_hash.lower())
+
+def forget_file_hash(file_path: str) -> None:
+    """
+    Drop a cached hash, e.g. after the file is replaced or deleted.
+
+    Args:
+        file_path: Path to the file
+    """
+    _cache.pop(file_path, None)
+
+async def cached_verify(
+    file_path: str,
+    expected_hash: str,
+    file_stat: Optional[os.stat_result] = None,
+    tree_hash: Optional[str] = None
+) -> bool:
+    """
+    Verify file integrity, rehashing only when the file changed since the last check.
+
+    The cached hash is trusted while the file's mtime and size are unchanged.
+    When a tree hash was recorded at upload it is checked instead, hashing on all cores.
+
+    Args:
+        file_path: Path to the file
+        expected_hash: Expected SHA-256 hex digest
+        file_stat: stat result for the file, if the caller already has one
+        tree_hash: Tree hash recorded at upload (see hash_utils.compute_tree_hash), if any
+
+    Returns:
+        bool: True if the file matches the expected hash
+    """
+    try:
+        if file_stat is None:
+            file_stat = os.stat(file_path)
+
+        entry = _cache.pop(file_path, None)
+        if entry and entry[:2] == (file_stat.st_mtime_ns, file_stat.st_size):
+            # Re-insert to mark as most recently used
+            _cache[file_path] = entry
+            file_hash = entry[2]
+        elif tree_hash:
+            # A matching tree hash means the content is what was uploaded, whose SHA-256 is expected_hash
+            if await compute_tree_hash(file_path) != tree_hash:
+                return False
+            file_hash = expected_hash.lower()
+            remember_file_hash(file_path, file_stat, file_hash)
+        else:
+            file_hash = await compute_file_hash(file_path)
+            remember_file_hash(file_path, file_stat, file_hash)
+
+        return file_hash == expected_hash.lower()
+    except Exception:
+        return False
@@ -0,0 +1,22 @@
+import uuid
+
+def is_uuid(value: str) -> bool:
+    """
+    Check whether a string is a canonical hyphenated UUID.
+    
+    Parses with uuid.UUID instead of a regex; the shape check rejects the
+    braced/urn/unhyphenated forms uuid.UUID would otherwise accept.
+    
+    Args:
+        value: The string to check
+        
+    Returns:
+        bool: True if the value is a UUID in 8-4-4-4-12 form
+    """
+    if len(value) != 36 or value.count("-") != 4:
+        return False
+    try:
+        uuid.UUID(value)
+        return True
+    except ValueError:
+        return False
@@ -0,0 +1,83 @@
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+from db.chat_crud import ChatCRUD
+
+MEMBERSHIP_CACHE_TTL_SECONDS = 30
+MEMBERSHIP_CACHE_MAX_SIZE = 10_000
+
+# Confirmed memberships: {(user_id, room_id): (valid_until_monotonic, role or None if unknown)}
+_cache: Dict[Tuple[str, str], Tuple[float, Optional[str]]] = {}
+
+def remember_membership(user_ids: Iterable[str], room_id: str, role: Optional[str] = None) -> None:
+    """
+    Record users as members of a room for the cache TTL.
+
+    Args:
+        user_ids: IDs of users known to be members
+        room_id: The chat room ID
+        role: Their role in the room, if known
+    """
+    valid_until = time.monotonic() + MEMBERSHIP_CACHE_TTL_SECONDS
+    for user_id in user_ids:
+        if len(_cache) >= MEMBERSHIP_CACHE_MAX_SIZE:
+            # Evict the oldest entry (dicts keep insertion order)
+            _cache.pop(next(iter(_cache)))
+        _cache[(user_id, room_id)] = (valid_until, role)
+
+def forget_membership(user_id: str, room_id: str) -> None:
+    """
+    Drop a cached membership, e.g. after a user leaves or is removed.
+
+    Args:
+        user_id: The user ID
+        room_id: The chat room ID
+    """
+    _cache.pop((user_id, room_id), None)
+
+def _fresh_entry(user_id: str, room_id: str) -> Optional[Tuple[float, Optional[str]]]:
+    entry = _cache.get((user_id, room_id))
+    if entry and entry[0] > time.monotonic():
+        return entry
+    return None
+
+async def is_user_in_room_cached(user_id: str, room_id: str) -> bool:
+    """
+    Check room membership, answering from the cache while an entry is fresh.
+
+    Only positive results are cached, so a newly added member is never turned away.
+
+    Args:
+        user_id: The user ID
+        room_id: The chat room ID
+
+    Returns:
+        bool: True if the user is a member of the room
+    """
+    if _fresh_entry(user_id, room_id):
+        return True
+
+    is_member = await ChatCRUD.is_user_in_room(user_id, room_id)
+    if is_member:
+        remember_membership((user_id,), room_id)
+    return is_member
+
+async def get_user_role_cached(user_id: str, room_id: str) -> Optional[str]:
+    """
+    Get a user's role in a room, answering from the cache while an entry with a known role is fresh.
+
+    Args:
+        user_id: The user ID
+        room_id: The chat room ID
+
+    Returns:
+        str: The user's role, or None if they are not a member
+    """
+    entry = _fresh_entry(user_id, room_id)
+    if entry and entry[1] is not None:
+        return entry[1]
+
+    role = await ChatCRUD.get_user_role_in_room(user_id, room_id)
+    if role is not None:
+        remember_membership((user_id,), room_id, role)
+    return role
@@ -0,0 +1,59 @@
+import asyncio
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from db.crud import get_file_session
+
+SESSION_CACHE_TTL_SECONDS = 60
+SESSION_CACHE_MAX_SIZE = 10_000
+
+# Upload sessions: {file_id: (valid_until_monotonic, session row)}
+_cache: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+
+async def get_file_session_cached(file_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Get an upload session, answering from the cache while an entry is fresh.
+    
+    Only fields fixed when the session is created (user_id, total_chunks, filename)
+    should be read from the result; progress and status may be stale.
+    
+    Args:
+        file_id: The upload's file ID
+        
+    Returns:
+        dict: The session row, or None if there is no such session
+    """
+    entry = _cache.get(file_id)
+    if entry and entry[0] > time.monotonic():
+        return entry[1]
+    
+    session = await asyncio.to_thread(get_file_session, file_id)
+    if session:
+        _store(file_id, session)
+    return session
+
+def remember_file_session(session: Dict[str, Any]) -> None:
+    """
+    Cache a session row just written, so the upload's first chunk skips the lookup.
+    
+    Args:
+        session: The row returned by create_file_session
+    """
+    # The placeholder returned when the insert fails has no owner; never cache it
+    if session.get("file_id") and session.get("user_id"):
+        _store(session["file_id"], session)
+
+def _store(file_id: str, session: Dict[str, Any]) -> None:
+    if len(_cache) >= SESSION_CACHE_MAX_SIZE:
+        # Evict the oldest entry (dicts keep insertion order)
+        _cache.pop(next(iter(_cache)))
+    _cache[file_id] = (time.monotonic() + SESSION_CACHE_TTL_SECONDS, session)
+
+def forget_file_session(file_id: str) -> None:
+    """
+    Drop a cached session, e.g. once the upload is completed or cancelled.
+    
+    Args:
+        file_id: The upload's file ID
+    """
+    _cache.pop(file_id, None)